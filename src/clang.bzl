@@ -1,5 +1,16 @@
-load("@bazel_tools//tools/build_defs/cc:action_names.bzl", "ACTION_NAMES")
-load("@bazel_tools//tools/cpp:toolchain_utils.bzl", "find_cpp_toolchain")
+load(
+    "compile_info.bzl",
+    "CompileInfo",
+    "compile_args",
+    "compile_info_arguments",
+    "compile_info_aspect",
+    "is_c_source",
+    "rule_sources",
+    "safe_flags",
+    "source_arguments",
+    "toolchain_flags",
+    "valid_compile_target",
+)
 
 CLANG_TIDY_WRAPPER_SCRIPT = """#!/usr/bin/env bash
 CLANG_TIDY=$1
@@ -187,103 +198,8 @@ def _run_analyzer(
     )
     return outfile
 
-def _rule_sources(ctx):
-    def check_valid_file_type(src):
-        """
-        Returns True if the file type matches one of the permitted srcs file types for C and C++ header/source files.
-        """
-        permitted_file_types = [
-            ".c",
-            ".cc",
-            ".cpp",
-            ".cxx",
-            ".c++",
-            ".C",
-            ".h",
-            ".hh",
-            ".hpp",
-            ".hxx",
-            ".inc",
-            ".inl",
-            ".H",
-        ]
-        for file_type in permitted_file_types:
-            if src.basename.endswith(file_type):
-                return True
-        return False
-
-    srcs = []
-    if hasattr(ctx.rule.attr, "srcs"):
-        for src in ctx.rule.attr.srcs:
-            srcs += [src for src in src.files.to_list() if src.is_source and check_valid_file_type(src)]
-    return srcs
-
-def _toolchain_flags(ctx, action_name = ACTION_NAMES.cpp_compile):
-    cc_toolchain = find_cpp_toolchain(ctx)
-    feature_configuration = cc_common.configure_features(
-        ctx = ctx,
-        cc_toolchain = cc_toolchain,
-    )
-    compile_variables = cc_common.create_compile_variables(
-        feature_configuration = feature_configuration,
-        cc_toolchain = cc_toolchain,
-        user_compile_flags = ctx.fragments.cpp.cxxopts + ctx.fragments.cpp.copts,
-    )
-    flags = cc_common.get_memory_inefficient_command_line(
-        feature_configuration = feature_configuration,
-        action_name = action_name,
-        variables = compile_variables,
-    )
-    return flags
-
-def _compile_args(compilation_context):
-    compile_args = []
-    for define in compilation_context.defines.to_list():
-        compile_args.append("-D" + define)
-    for define in compilation_context.local_defines.to_list():
-        compile_args.append("-D" + define)
-    for include in compilation_context.framework_includes.to_list():
-        compile_args.append("-F" + include)
-    for include in compilation_context.includes.to_list():
-        compile_args.append("-I" + include)
-    for include in compilation_context.quote_includes.to_list():
-        compile_args.append("-iquote " + include)
-    for include in compilation_context.system_includes.to_list():
-        compile_args.append("-isystem " + include)
-    return compile_args
-
-def _safe_flags(flags):
-    # Some flags might be used by GCC, but not understood by Clang.
-    # Remove them here, to allow users to run clang-tidy, without having
-    # a clang toolchain configured (that would produce a good command line with --compiler clang)
-    unsupported_flags = [
-        "-fno-canonical-system-headers",
-        "-fstack-usage",
-    ]
-
-    return [flag for flag in flags if flag not in unsupported_flags]
-
-def _valid_for_clang_tidy(target, ctx):
-    # if not a C/C++ target, we are not interested
-    if not CcInfo in target:
-        return False
-
-    # Ignore external targets
-    if target.label.workspace_root.startswith("external"):
-        return False
-
-    # Targets with specific tags will not be formatted
-    ignore_tags = [
-        "noclangtidy",
-        "no-clang-tidy",
-    ]
-    for tag in ignore_tags:
-        if tag in ctx.rule.attr.tags:
-            return False
-    return True
-
 def _clang_tidy_aspect_impl(target, ctx):
-    if not _valid_for_clang_tidy(target, ctx):
+    if not valid_compile_target(target, ctx):
         return []
 
     exe = ctx.attr._clang_tidy_executable
@@ -296,14 +212,19 @@ def _clang_tidy_aspect_impl(target, ctx):
         default_options = ctx.attr._default_options
     compilation_context = target[CcInfo].compilation_context
 
-    rule_flags = ctx.rule.attr.copts if hasattr(ctx.rule.attr, "copts") else []
-    c_flags = _safe_flags(_toolchain_flags(ctx, ACTION_NAMES.c_compile) + rule_flags) + ["-xc"]
-    cxx_flags = _safe_flags(_toolchain_flags(ctx, ACTION_NAMES.cpp_compile) + rule_flags) + ["-xc++"]
-    compile_args = _compile_args(compilation_context)
-    c_flags += compile_args
-    cxx_flags += compile_args
+    # Reuse flags of compile_info_aspect if it runs before this aspect
+    if CompileInfo in target:
+        arguments = compile_info_arguments(target[CompileInfo])
+        c_flags = arguments.c + ["-xc"]
+        cxx_flags = arguments.cxx + ["-xc++"]
+    else:
+        rule_flags = ctx.rule.attr.copts if hasattr(ctx.rule.attr, "copts") else []
+        flags = toolchain_flags(ctx)
+        args = compile_args(compilation_context)
+        c_flags = safe_flags(flags.c_flags + rule_flags) + ["-xc"] + args
+        cxx_flags = safe_flags(flags.cxx_flags + rule_flags) + ["-xc++"] + args
 
-    srcs = _rule_sources(ctx)
+    srcs = rule_sources(ctx)
 
     outputs = [
         _run_tidy(
@@ -313,7 +234,7 @@ def _clang_tidy_aspect_impl(target, ctx):
             default_options,
             compilation_context,
             src,
-            c_flags if src.extension in ["c", "C"] else cxx_flags,
+            c_flags if is_c_source(src) else cxx_flags,
             target.label.name,
             additional_deps,
         )
@@ -333,67 +254,7 @@ clang_tidy_aspect = aspect(
         "_clang_tidy_config": attr.label(default = Label("@bazel_codechecker//src:clang_tidy_config")),
         "_default_options": attr.string_list(default = ["--use-color", "--warnings-as-errors=*"]),
     },
-    toolchains = ["@bazel_tools//tools/cpp:toolchain_type"],
-)
-
-CompileInfo = provider(
-    doc = "Source files and corresponding compilation arguments",
-    fields = {
-        "arguments": "dict: file -> list of arguments",
-    },
-)
-
-def _compile_info_sources(deps):
-    sources = []
-    if type(deps) == "list":
-        for dep in deps:
-            if CompileInfo in dep:
-                if hasattr(dep[CompileInfo], "arguments"):
-                    srcs = dep[CompileInfo].arguments.keys()
-                    sources += srcs
-    return sources
-
-def _collect_all_sources(ctx):
-    sources = _rule_sources(ctx)
-    for attr in ["srcs", "deps", "data", "exports"]:
-        if hasattr(ctx.rule.attr, attr):
-            deps = getattr(ctx.rule.attr, attr)
-            sources += _compile_info_sources(deps)
-
-    # Remove duplicates
-    sources = depset(sources).to_list()
-    return sources
-
-def _compile_info_aspect_impl(target, ctx):
-    if not _valid_for_clang_tidy(target, ctx):
-        return []
-
-    compilation_context = target[CcInfo].compilation_context
-
-    rule_flags = ctx.rule.attr.copts if hasattr(ctx.rule.attr, "copts") else []
-    c_flags = _safe_flags(_toolchain_flags(ctx, ACTION_NAMES.c_compile) + rule_flags)  # + ["-xc"]
-    cxx_flags = _safe_flags(_toolchain_flags(ctx, ACTION_NAMES.cpp_compile) + rule_flags)  # + ["-xc++"]
-
-    srcs = _collect_all_sources(ctx)
-
-    compile_args = _compile_args(compilation_context)
-    arguments = {}
-    for src in srcs:
-        flags = c_flags if src.extension in ["c", "C"] else cxx_flags
-        arguments[src] = compile_args + flags
-    return [
-        CompileInfo(
-            arguments = arguments,
-        ),
-    ]
-
-compile_info_aspect = aspect(
-    implementation = _compile_info_aspect_impl,
-    fragments = ["cpp"],
-    attrs = {
-        "_cc_toolchain": attr.label(default = Label("@bazel_tools//tools/cpp:current_cc_toolchain")),
-    },
-    attr_aspects = ["srcs", "deps", "data", "exports"],
+    required_aspect_providers = [CompileInfo],
     toolchains = ["@bazel_tools//tools/cpp:toolchain_type"],
 )
 
@@ -405,24 +266,25 @@ def _clang_test(ctx, tool):
         if not CcInfo in target:
             continue
         if CompileInfo in target:
-            if hasattr(target[CompileInfo], "arguments"):
-                srcs = target[CompileInfo].arguments.keys()
-                all_files += srcs
-                compilation_context = target[CcInfo].compilation_context
-                for src in srcs:
-                    arguments = target[CompileInfo].arguments[src]
-                    report = tool(
-                        ctx,
-                        ctx.attr.executable,
-                        ctx.attr.config_file,
-                        ctx.attr.default_options + ctx.attr.options,
-                        compilation_context,
-                        src,
-                        arguments,
-                        ctx.attr.name,
-                    )
-                    all_files.append(report)
-                    # headers = depset(transitive = [headers, compilation_context.headers])
+            compile_info = target[CompileInfo]
+            srcs = compile_info.tidy_sources.to_list()
+            all_files += srcs
+            compilation_context = target[CcInfo].compilation_context
+            target_arguments = compile_info_arguments(compile_info, defines_first = True)
+            for src in srcs:
+                arguments = source_arguments(target_arguments, src)
+                report = tool(
+                    ctx,
+                    ctx.attr.executable,
+                    ctx.attr.config_file,
+                    ctx.attr.default_options + ctx.attr.options,
+                    compilation_context,
+                    src,
+                    arguments,
+                    ctx.attr.name,
+                )
+                all_files.append(report)
+                # headers = depset(transitive = [headers, compilation_context.headers])
 
     ctx.actions.write(
         output = ctx.outputs.test_script,
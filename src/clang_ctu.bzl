@@ -1,5 +1,10 @@
-load("@bazel_tools//tools/build_defs/cc:action_names.bzl", "ACTION_NAMES")
-load("@bazel_tools//tools/cpp:toolchain_utils.bzl", "find_cpp_toolchain")
+load(
+    "compile_info.bzl",
+    "CompileInfo",
+    "compile_info_arguments",
+    "compile_info_aspect",
+    "source_arguments",
+)
 
 CLANG_CTU_WRAPPER_SCRIPT = """#set -x
 REPORT_TYPE=$1
@@ -110,157 +115,17 @@ def _run_clang_ctu(
     )
     return outputs
 
-def _rule_sources(ctx):
-    def check_valid_file_type(src):
-        """
-        Returns True if the file type matches one of the permitted
-        srcs file types for C and C++ header/source files.
-        """
-        permitted_file_types = [
-            ".c",
-            ".cc",
-            ".cpp",
-            ".cxx",
-            ".c++",
-            ".C",
-            ".h",
-            ".hh",
-            ".hpp",
-            ".hxx",
-            ".inc",
-            ".inl",
-            ".H",
-        ]
-        for file_type in permitted_file_types:
-            if src.basename.endswith(file_type):
-                return True
-        return False
-
-    srcs = []
-    if hasattr(ctx.rule.attr, "srcs"):
-        for src in ctx.rule.attr.srcs:
-            srcs += [src for src in src.files.to_list() if src.is_source and check_valid_file_type(src)]
-    return srcs
-
-def _toolchain_flags(ctx, action_name, with_compiler = False):
-    cc_toolchain = find_cpp_toolchain(ctx)
-    feature_configuration = cc_common.configure_features(
-        ctx = ctx,
-        cc_toolchain = cc_toolchain,
-    )
-    compile_variables = cc_common.create_compile_variables(
-        feature_configuration = feature_configuration,
-        cc_toolchain = cc_toolchain,
-        user_compile_flags = ctx.fragments.cpp.cxxopts + ctx.fragments.cpp.copts,
-    )
-    flags = cc_common.get_memory_inefficient_command_line(
-        feature_configuration = feature_configuration,
-        action_name = action_name,
-        variables = compile_variables,
-    )
-    if not with_compiler:
-        return flags
-    compiler = cc_common.get_tool_for_action(
-        feature_configuration = feature_configuration,
-        action_name = action_name,
-    )
-    return [compiler] + flags
-
-def _compile_args(compilation_context):
-    compile_args = []
-    for define in compilation_context.defines.to_list():
-        compile_args.append("-D" + define)
-    for define in compilation_context.local_defines.to_list():
-        compile_args.append("-D" + define)
-    for include in compilation_context.framework_includes.to_list():
-        compile_args.append("-F" + include)
-    for include in compilation_context.includes.to_list():
-        compile_args.append("-I" + include)
-    for include in compilation_context.quote_includes.to_list():
-        compile_args.append("-iquote " + include)
-    for include in compilation_context.system_includes.to_list():
-        compile_args.append("-isystem " + include)
-    return compile_args
-
-def _safe_flags(flags):
-    # Some flags might be used by GCC, but not understood by Clang.
-    # Remove them here, to allow users to run analysis, without having
-    # a clang toolchain configured (that would produce a good command line with --compiler clang)
-    unsupported_flags = [
-        "-fno-canonical-system-headers",
-        "-fstack-usage",
-    ]
-
-    return [flag for flag in flags if flag not in unsupported_flags]
-
-CompileInfo = provider(
-    doc = "Source files and corresponding compilation arguments",
-    fields = {
-        "arguments": "dict: file -> list of arguments",
-    },
-)
-
-def _compile_info_sources(deps):
-    sources = []
-    if type(deps) == "list":
-        for dep in deps:
-            if CompileInfo in dep:
-                if hasattr(dep[CompileInfo], "arguments"):
-                    srcs = dep[CompileInfo].arguments.keys()
-                    sources += srcs
-    return sources
-
-def _collect_all_sources(ctx):
-    sources = _rule_sources(ctx)
-    for attr in ["srcs", "deps", "data", "exports"]:
-        if hasattr(ctx.rule.attr, attr):
-            deps = getattr(ctx.rule.attr, attr)
-            sources += _compile_info_sources(deps)
-    sources = depset(sources).to_list()  # Remove duplicates
-    return sources
-
-def _compile_info_aspect_impl(target, ctx):
-    compilation_context = target[CcInfo].compilation_context
-
-    rule_flags = ctx.rule.attr.copts if hasattr(ctx.rule.attr, "copts") else []
-    c_flags = _safe_flags(_toolchain_flags(ctx, ACTION_NAMES.c_compile) + rule_flags)  # + ["-xc"]
-    cxx_flags = _safe_flags(_toolchain_flags(ctx, ACTION_NAMES.cpp_compile) + rule_flags)  # + ["-xc++"]
-
-    srcs = _collect_all_sources(ctx)
-
-    compile_args = _compile_args(compilation_context)
-    arguments = {}
-    for src in srcs:
-        flags = c_flags if src.extension in ["c", "C"] else cxx_flags
-        arguments[src] = flags + compile_args  # + [src.path]
-    return [
-        CompileInfo(
-            arguments = arguments,
-        ),
-    ]
-
-compile_info_aspect = aspect(
-    implementation = _compile_info_aspect_impl,
-    fragments = ["cpp"],
-    attrs = {
-        "_cc_toolchain": attr.label(default = Label("@bazel_tools//tools/cpp:current_cc_toolchain")),
-    },
-    attr_aspects = ["srcs", "deps", "data", "exports"],
-    toolchains = ["@bazel_tools//tools/cpp:toolchain_type"],
-)
-
 def _generate_ast_and_def_files(ctx, target, all_sources):
     if not CcInfo in target:
         return ([], [])
     if CompileInfo not in target:
         return ([], [])
-    if not hasattr(target[CompileInfo], "arguments"):
-        return ([], [])
     ast_files = []
     def_files = []
-    srcs = target[CompileInfo].arguments.keys()
-    for src in srcs:
-        args = target[CompileInfo].arguments[src]
+    compile_info = target[CompileInfo]
+    arguments = compile_info_arguments(compile_info)
+    for src in compile_info.sources.to_list():
+        args = source_arguments(arguments, src)
         file_path = ctx.label.name + "." + target.label.name + "/" + src.path
 
         # clang $CCFLAGS $FILEPATH -emit-ast -D__clang_analyzer__ -w -o $AST_FILE
@@ -309,13 +174,12 @@ def _collect_all_sources_and_headers(ctx):
         if not CcInfo in target:
             continue
         if CompileInfo in target:
-            if hasattr(target[CompileInfo], "arguments"):
-                srcs = target[CompileInfo].arguments.keys()
-                all_files += srcs
-                compilation_context = target[CcInfo].compilation_context
-                headers = depset(
-                    transitive = [headers, compilation_context.headers],
-                )
+            srcs = target[CompileInfo].sources.to_list()
+            all_files += srcs
+            compilation_context = target[CcInfo].compilation_context
+            headers = depset(
+                transitive = [headers, compilation_context.headers],
+            )
     sources_and_headers = all_files + headers.to_list()
     return sources_and_headers
 
@@ -328,14 +192,14 @@ def _clang_ctu_impl(ctx):
             continue
         if CompileInfo not in target:
             continue
-        if not hasattr(target[CompileInfo], "arguments"):
-            continue
         ast_files, def_files = _generate_ast_and_def_files(ctx, target, sources_and_headers)
         all_files += ast_files + def_files
-        srcs = target[CompileInfo].arguments.keys()
+        compile_info = target[CompileInfo]
+        srcs = compile_info.sources.to_list()
         all_files += srcs
+        arguments = compile_info_arguments(compile_info)
         for src in srcs:
-            args = target[CompileInfo].arguments[src]
+            args = source_arguments(arguments, src)
             outputs = _run_clang_ctu(
                 ctx,
                 src,
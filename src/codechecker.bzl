@@ -2,10 +2,16 @@
 
 load(
     "compile_commands.bzl",
+    "SourceFilesInfo",
     "compile_commands_aspect",
     "compile_commands_impl",
+    "get_sources",
     "platforms_transition",
 )
+load(
+    "compile_info.bzl",
+    "compile_info_aspect",
+)
 load(
     "@default_codechecker_tools//:defs.bzl",
     "CODECHECKER_BIN_PATH",
@@ -67,19 +73,168 @@ codechecker_config = rule(
     },
 )
 
-def _copy_config_to_default(config_file, ctx):
+def _copy_config_to_default(config_file, ctx, output):
     ctx.actions.run(
         inputs = [config_file],
-        outputs = [ctx.outputs.codechecker_config],
+        outputs = [output],
         mnemonic = "CopyFile",
         progress_message = "Copying CodeChecker config file",
         executable = "cp",
         arguments = [
             config_file.path,
-            ctx.outputs.codechecker_config.path,
+            output.path,
         ],
     )
 
+def _codechecker_config_file(ctx, config_info, output):
+    """ Create CodeChecker JSON config file
+
+    Returns:
+      string: packed env vars for CodeChecker
+    """
+    if not config_info:
+        # Empty CodeChecker JSON config file
+        ctx.actions.write(
+            output = output,
+            content = "{}",
+            is_executable = False,
+        )
+        return ""
+    if config_info.config_file:
+        # Create a copy of CodeChecker configuration file
+        # provided via codechecker_config(config_file)
+        config_file = config_info.config_file.files.to_list()[0]
+        _copy_config_to_default(config_file, ctx, output)
+    else:
+        # Create CodeChecker configuration file in JSON format
+        # from Bazel codechecker_config(analyze, parse)
+        config_json = {}
+        if config_info.analyze:
+            config_json["analyze"] = config_info.analyze
+        if config_info.parse:
+            config_json["parse"] = config_info.parse
+        config_content = json.encode_indent(config_json)
+        ctx.actions.write(
+            output = output,
+            content = config_content,
+            is_executable = False,
+        )
+
+    # Pack env vars for CodeChecker
+    return "; ".join(config_info.env)
+
+_source_extensions = [
+    "c",
+    "cc",
+    "cpp",
+    "cxx",
+    "c++",
+    "C",
+]
+
+def _glob_match(pattern, path):
+    """ Match path against glob pattern with "*" wildcards """
+    parts = pattern.split("*")
+    if len(parts) == 1:
+        return pattern == path
+    if len(parts[0]) + len(parts[-1]) > len(path):
+        return False
+    if not path.startswith(parts[0]) or not path.endswith(parts[-1]):
+        return False
+    position = len(parts[0])
+    end = len(path) - len(parts[-1])
+    for part in parts[1:-1]:
+        index = path.find(part, position, end)
+        if index == -1:
+            return False
+        position = index + len(part)
+    return True
+
+def _is_skipped(path, skip):
+    """ Check if file is skipped by skipfile rules, the same way as compile_commands_filter.py
+
+    Only rules starting with "*" are evaluated: CodeChecker matches rules
+    against absolute paths, which end with "/" + path.
+
+    Returns:
+      True if the first matching rule is "-".
+    """
+    path = "/" + path
+    for rule in skip:
+        rule = rule.strip()
+        if not rule or rule.startswith("#"):
+            continue
+        sign = rule[0]
+        pattern = rule[1:]
+        if sign not in ["+", "-"] or not pattern.startswith("*") or "?" in pattern or "[" in pattern:
+            # Rule is left to CodeChecker, keep the file
+            return False
+        if _glob_match(pattern, path):
+            return sign == "-"
+        if sign == "+":
+            # CodeChecker may keep the file by this rule
+            return False
+    return False
+
+def _filter_skipped(source_files, skip):
+    """ Remove skipped source files, header files are kept
+
+    Returns:
+      List of files.
+    """
+    if not skip:
+        return source_files
+    return [
+        src
+        for src in source_files
+        if src.extension not in _source_extensions or not _is_skipped(src.path, skip)
+    ]
+
+def _local_file_path(ctx, name):
+    """ Return absolute path of a local file given by attribute name
+
+    Make variables are expanded, e.g. $(TMPDIR) given by --define=TMPDIR=...
+
+    Returns:
+      Absolute path or "" if attribute is not set
+    """
+    path = getattr(ctx.attr, name)
+    if not path:
+        return ""
+    for key, value in ctx.var.items():
+        path = path.replace("$(%s)" % key, value)
+    if not path.startswith("/"):
+        fail("%s must be an absolute path: %s" % (name, path))
+    return path
+
+def _index_results(ctx, codechecker_files):
+    """ Load CodeChecker results into SQLite index if index_file is set
+
+    Returns:
+      Index file of the results or None
+    """
+    index_file = _local_file_path(ctx, "index_file")
+    if not index_file:
+        return None
+    codechecker_index = ctx.actions.declare_file(ctx.label.name + "/codechecker_index.sqlite")
+    ctx.actions.run(
+        inputs = [codechecker_files],
+        outputs = [codechecker_index],
+        executable = ctx.executable._codechecker_index,
+        arguments = [
+            "load",
+            "--input=" + codechecker_files.path + "/result.json",
+            "--database=" + codechecker_index.path,
+            "--local-database=" + index_file,
+            "--run=" + str(ctx.label),
+        ],
+        mnemonic = "CodeCheckerIndex",
+        progress_message = "Indexing CodeChecker results %s" % str(ctx.label),
+        # Local index file is written outside of output tree
+        execution_requirements = {"no-cache": "1", "no-remote": "1"},
+    )
+    return codechecker_index
+
 def _codechecker_impl(ctx):
     py_runtime_info = ctx.attr._python_runtime[PyRuntimeInfo]
     python_path = py_runtime_info.interpreter_path
@@ -98,65 +253,54 @@ def _codechecker_impl(ctx):
     if compile_commands != ctx.outputs.compile_commands:
         fail("Seems compile_commands.json file is incorrect!")
 
-    # Convert flacc calls to clang in compile_commands.json
-    # and save to codechecker_commands.json
+    # Do not stage skipped source files
+    source_files = _filter_skipped(source_files, ctx.attr.skip)
+
+    # Create CodeChecker skip (ignore) file
+    ctx.actions.write(
+        output = ctx.outputs.codechecker_skipfile,
+        content = "\n".join(ctx.attr.skip),
+        is_executable = False,
+    )
+
+    # Convert flacc calls to clang in compile_commands.json,
+    # remove skipped files and save to codechecker_commands.json
     ctx.actions.run(
-        inputs = [ctx.outputs.compile_commands],
+        inputs = [
+            ctx.outputs.compile_commands,
+            ctx.outputs.codechecker_skipfile,
+        ],
         outputs = [ctx.outputs.codechecker_commands],
         executable = ctx.executable._compile_commands_filter,
         arguments = [
             # "-v",  # -vv for debug
             "--input=" + ctx.outputs.compile_commands.path,
             "--output=" + ctx.outputs.codechecker_commands.path,
+            "--skipfile=" + ctx.outputs.codechecker_skipfile.path,
         ],
         mnemonic = "CodeCheckerConvertFlaccToClang",
         progress_message = "Filtering %s" % str(ctx.label),
         # use_default_shell_env = True,
     )
 
-    # Create CodeChecker skip (ignore) file
-    ctx.actions.write(
-        output = ctx.outputs.codechecker_skipfile,
-        content = "\n".join(ctx.attr.skip),
-        is_executable = False,
-    )
-
     # Create CodeChecker JSON config file and env vars
+    config_info = None
     if ctx.attr.config:
         if type(ctx.attr.config) == "list":
             config_info = ctx.attr.config[0][CodeCheckerConfigInfo]
         else:
             config_info = ctx.attr.config[CodeCheckerConfigInfo]
-        if config_info.config_file:
-            # Create a copy of CodeChecker configuration file
-            # provided via codechecker_config(config_file)
-            config_file = config_info.config_file.files.to_list()[0]
-            _copy_config_to_default(config_file, ctx)
-        else:
-            # Create CodeChecker configuration file in JSON format
-            # from Bazel codechecker_config(analyze, parse)
-            config_json = {}
-            if config_info.analyze:
-                config_json["analyze"] = config_info.analyze
-            if config_info.parse:
-                config_json["parse"] = config_info.parse
-            config_content = json.encode_indent(config_json)
-            ctx.actions.write(
-                output = ctx.outputs.codechecker_config,
-                content = config_content,
-                is_executable = False,
-            )
-
-        # Pack env vars for CodeChecker
-        codechecker_env = "; ".join(config_info.env)
-    else:
-        # Empty CodeChecker JSON config file
-        ctx.actions.write(
-            output = ctx.outputs.codechecker_config,
-            content = "{}",
-            is_executable = False,
-        )
-        codechecker_env = ""
+    codechecker_env = _codechecker_config_file(
+        ctx,
+        config_info,
+        ctx.outputs.codechecker_config,
+    )
+
+    # Local stats file is written outside of output tree
+    stats_file = _local_file_path(ctx, "stats_file")
+    execution_requirements = {}
+    if stats_file:
+        execution_requirements = {"no-cache": "1", "no-remote": "1"}
 
     codechecker_files = ctx.actions.declare_directory(ctx.label.name + "/codechecker-files")
     ctx.actions.expand_template(
@@ -175,6 +319,8 @@ def _codechecker_impl(ctx):
             "{codechecker_files}": codechecker_files.path,
             "{codechecker_log}": ctx.outputs.codechecker_log.path,
             "{codechecker_env}": codechecker_env,
+            "{codechecker_stats}": stats_file,
+            "{codechecker_outlier_factor}": str(ctx.attr.outlier_factor),
         },
     )
 
@@ -195,9 +341,14 @@ def _codechecker_impl(ctx):
         arguments = [],
         mnemonic = "CodeChecker",
         progress_message = "CodeChecker %s" % str(ctx.label),
+        execution_requirements = execution_requirements,
         # use_default_shell_env = True,
     )
 
+    # Optionally load results into SQLite index
+    codechecker_index = _index_results(ctx, codechecker_files)
+    index_files = [codechecker_index] if codechecker_index else []
+
     # List all files required at build and run (test) time
     all_files = [
         ctx.outputs.compile_commands,
@@ -207,12 +358,12 @@ def _codechecker_impl(ctx):
         codechecker_files,
         ctx.outputs.codechecker_script,
         ctx.outputs.codechecker_log,
-    ] + source_files
+    ] + index_files + source_files
 
     # List files required for test
     run_files = [
         codechecker_files,
-    ] + source_files
+    ] + index_files + source_files
 
     # Return all files
     return [
@@ -222,6 +373,7 @@ def _codechecker_impl(ctx):
         ),
         OutputGroupInfo(
             codechecker_files = depset([codechecker_files]),
+            codechecker_index = depset(index_files),
         ),
     ]
 
@@ -230,6 +382,7 @@ codechecker = rule(
     attrs = {
         "targets": attr.label_list(
             aspects = [
+                compile_info_aspect,
                 compile_commands_aspect,
             ],
             doc = "List of compilable targets which should be checked.",
@@ -247,6 +400,17 @@ codechecker = rule(
             default = [],
             doc = "List of analyze command agruments, e.g.; --ctu.",
         ),
+        "stats_file": attr.string(
+            default = "",
+            doc = "Local file (absolute path) to keep per-file analysis durations between runs. " +
+                  "When set, the slowest files are analyzed first. " +
+                  "Must be writable from the sandbox, e.g. --sandbox_writable_path",
+        ),
+        "outlier_factor": attr.int(
+            default = 0,
+            doc = "Analysis timeout for known slow files, " +
+                  "as a multiple of the median duration from stats_file (0 = no timeout)",
+        ),
         "_compile_commands_filter": attr.label(
             allow_files = True,
             executable = True,
@@ -257,6 +421,18 @@ codechecker = rule(
             default = ":codechecker_script.py",
             allow_single_file = True,
         ),
+        "index_file": attr.string(
+            default = "",
+            doc = "Local SQLite file (absolute path) to merge results into, see codechecker_index.py. " +
+                  "When set, results of the run are also indexed in codechecker_index.sqlite. " +
+                  "Must be writable from the sandbox, e.g. --sandbox_writable_path",
+        ),
+        "_codechecker_index": attr.label(
+            allow_files = True,
+            executable = True,
+            cfg = "host",
+            default = ":codechecker_index",
+        ),
         "_python_runtime": attr.label(
             default = "@default_python_tools//:py3_runtime",
         ),
@@ -271,6 +447,163 @@ codechecker = rule(
     },
 )
 
+CodeCheckerResultsInfo = provider(
+    doc = "CodeChecker analysis results of a target and its dependencies",
+    fields = {
+        "data": "depset of CodeChecker analyze output folders",
+        "source_files": "depset of analyzed source and header files",
+    },
+)
+
+_source_attr = [
+    "srcs",
+    "deps",
+    "data",
+    "exports",
+]
+
+def _config_flag_info(ctx):
+    """ Return CodeChecker configuration from codechecker_config flag or None """
+    if CodeCheckerConfigInfo in ctx.attr._codechecker_config:
+        return ctx.attr._codechecker_config[CodeCheckerConfigInfo]
+    return None
+
+def _analyze_library(target, ctx):
+    """ Run CodeChecker analyze for source files of the target itself
+
+    Returns:
+      CodeChecker analyze output folder
+    """
+    py_runtime_info = ctx.attr._python_runtime[PyRuntimeInfo]
+    python_path = py_runtime_info.interpreter_path
+    config_info = _config_flag_info(ctx)
+    name = target.label.name + ".codechecker"
+
+    # Compilation database of the target itself
+    compile_commands = ctx.actions.declare_file(name + "/compile_commands.json")
+    ctx.actions.write(
+        output = compile_commands,
+        content = json.encode_indent(target[SourceFilesInfo].direct_compilation_db),
+        is_executable = False,
+    )
+    codechecker_commands = ctx.actions.declare_file(name + "/codechecker_commands.json")
+    ctx.actions.run(
+        inputs = [compile_commands],
+        outputs = [codechecker_commands],
+        executable = ctx.executable._compile_commands_filter,
+        arguments = [
+            "--input=" + compile_commands.path,
+            "--output=" + codechecker_commands.path,
+        ],
+        mnemonic = "CodeCheckerConvertFlaccToClang",
+        progress_message = "Filtering %s" % str(target.label),
+    )
+
+    # Skip rules are applied by each codechecker_test at parse step
+    codechecker_skipfile = ctx.actions.declare_file(name + "/codechecker_skipfile.cfg")
+    ctx.actions.write(
+        output = codechecker_skipfile,
+        content = "",
+        is_executable = False,
+    )
+    codechecker_config = ctx.actions.declare_file(name + "/codechecker_config.json")
+    codechecker_env = _codechecker_config_file(ctx, config_info, codechecker_config)
+
+    codechecker_files = ctx.actions.declare_directory(name + "/codechecker-files")
+    codechecker_log = ctx.actions.declare_file(name + "/codechecker.log")
+    codechecker_script = ctx.actions.declare_file(name + "/codechecker_script.py")
+    ctx.actions.expand_template(
+        template = ctx.file._codechecker_script_template,
+        output = codechecker_script,
+        is_executable = True,
+        substitutions = {
+            "{Mode}": "Analyze",
+            "{Verbosity}": "DEBUG",
+            "{PythonPath}": python_path,
+            "{codechecker_bin}": CODECHECKER_BIN_PATH,
+            "{compile_commands}": codechecker_commands.path,
+            "{codechecker_skipfile}": codechecker_skipfile.path,
+            "{codechecker_config}": codechecker_config.path,
+            "{codechecker_analyze}": "",
+            "{codechecker_files}": codechecker_files.path,
+            "{codechecker_log}": codechecker_log.path,
+            "{codechecker_env}": codechecker_env,
+            "{codechecker_stats}": "",
+            "{codechecker_outlier_factor}": "0",
+        },
+    )
+
+    ctx.actions.run(
+        inputs = depset(
+            [
+                codechecker_script,
+                codechecker_commands,
+                codechecker_skipfile,
+                codechecker_config,
+            ] + get_sources(ctx),
+            transitive = [target[SourceFilesInfo].headers],
+        ),
+        outputs = [
+            codechecker_files,
+            codechecker_log,
+        ],
+        executable = codechecker_script,
+        arguments = [],
+        mnemonic = "CodeChecker",
+        progress_message = "CodeChecker %s" % str(target.label),
+    )
+    return codechecker_files
+
+def _codechecker_aspect_impl(target, ctx):
+    data = []
+    source_files = []
+    for attr in _source_attr:
+        if hasattr(ctx.rule.attr, attr):
+            deps = getattr(ctx.rule.attr, attr)
+            if type(deps) == "list":
+                for dep in deps:
+                    if CodeCheckerResultsInfo in dep:
+                        data.append(dep[CodeCheckerResultsInfo].data)
+                        source_files.append(dep[CodeCheckerResultsInfo].source_files)
+
+    # Analyze only files of the target itself, dependencies are analyzed separately
+    direct = []
+    if SourceFilesInfo in target and target[SourceFilesInfo].direct_compilation_db:
+        direct.append(_analyze_library(target, ctx))
+        source_files.append(depset(get_sources(ctx), transitive = [target[SourceFilesInfo].headers]))
+
+    return [
+        CodeCheckerResultsInfo(
+            data = depset(direct, transitive = data),
+            source_files = depset(transitive = source_files),
+        ),
+    ]
+
+codechecker_aspect = aspect(
+    implementation = _codechecker_aspect_impl,
+    attr_aspects = _source_attr,
+    required_aspect_providers = [SourceFilesInfo],
+    provides = [CodeCheckerResultsInfo],
+    attrs = {
+        "_codechecker_config": attr.label(
+            default = Label("@bazel_codechecker//src:codechecker_config"),
+        ),
+        "_compile_commands_filter": attr.label(
+            allow_files = True,
+            executable = True,
+            cfg = "host",
+            default = Label("@bazel_codechecker//src:compile_commands_filter"),
+        ),
+        "_codechecker_script_template": attr.label(
+            default = Label("@bazel_codechecker//src:codechecker_script.py"),
+            allow_single_file = True,
+        ),
+        "_python_runtime": attr.label(
+            default = Label("@default_python_tools//:py3_runtime"),
+        ),
+    },
+)
+
 def _codechecker_test_impl(ctx):
     py_runtime_info = ctx.attr._python_runtime[PyRuntimeInfo]
     python_path = py_runtime_info.interpreter_path
@@ -280,12 +613,16 @@ def _codechecker_test_impl(ctx):
     all_files = []
     default_runfiles = []
     codechecker_files = []
+    codechecker_index = ""
     for output in info:
         if type(output) == "DefaultInfo":
             all_files = output.files.to_list()
             default_runfiles = output.default_runfiles.files.to_list()
         if type(output) == "OutputGroupInfo":
             codechecker_files = output.codechecker_files.to_list()[0]
+            for index_file in output.codechecker_index.to_list():
+                codechecker_index = index_file.short_path
+    index_tool = ctx.file._codechecker_index_script if codechecker_index else None
     if not all_files:
         fail("Files required for codechecker test are not available")
     if not codechecker_files:
@@ -302,12 +639,16 @@ def _codechecker_test_impl(ctx):
             "{PythonPath}": python_path,
             "{codechecker_bin}": CODECHECKER_BIN_PATH,
             "{codechecker_files}": codechecker_files.short_path,
+            "{codechecker_index}": codechecker_index,
+            "{codechecker_index_tool}": index_tool.short_path if index_tool else "",
             "{Severities}": " ".join(ctx.attr.severities),
         },
     )
 
     # Return test script and all required files
     run_files = default_runfiles + [ctx.outputs.codechecker_test_script]
+    if index_tool:
+        run_files.append(index_tool)
     return [
         DefaultInfo(
             files = depset(all_files),
@@ -325,6 +666,7 @@ _codechecker_test = rule(
         ),
         "targets": attr.label_list(
             aspects = [
+                compile_info_aspect,
                 compile_commands_aspect,
             ],
             cfg = platforms_transition,
@@ -344,6 +686,22 @@ _codechecker_test = rule(
             default = ":codechecker_script.py",
             allow_single_file = True,
         ),
+        "index_file": attr.string(
+            default = "",
+            doc = "Local SQLite file (absolute path) to merge results into, see codechecker_index.py. " +
+                  "When set, results of the run are also indexed in codechecker_index.sqlite. " +
+                  "Must be writable from the sandbox, e.g. --sandbox_writable_path",
+        ),
+        "_codechecker_index": attr.label(
+            allow_files = True,
+            executable = True,
+            cfg = "host",
+            default = ":codechecker_index",
+        ),
+        "_codechecker_index_script": attr.label(
+            default = ":codechecker_index.py",
+            allow_single_file = True,
+        ),
         "_python_runtime": attr.label(
             default = "@default_python_tools//:py3_runtime",
         ),
@@ -365,6 +723,17 @@ _codechecker_test = rule(
             default = [],
             doc = "List of analyze command agruments, e.g. --ctu",
         ),
+        "stats_file": attr.string(
+            default = "",
+            doc = "Local file (absolute path) to keep per-file analysis durations between runs. " +
+                  "When set, the slowest files are analyzed first. " +
+                  "Must be writable from the sandbox, e.g. --sandbox_writable_path",
+        ),
+        "outlier_factor": attr.int(
+            default = 0,
+            doc = "Analysis timeout for known slow files, " +
+                  "as a multiple of the median duration from stats_file (0 = no timeout)",
+        ),
     },
     outputs = {
         "compile_commands": "%{name}/compile_commands.json",
@@ -378,6 +747,184 @@ _codechecker_test = rule(
     test = True,
 )
 
+def _codechecker_library_test_impl(ctx):
+    py_runtime_info = ctx.attr._python_runtime[PyRuntimeInfo]
+    python_path = py_runtime_info.interpreter_path
+
+    # Collect analysis results of all targets and their dependencies
+    data = depset(transitive = [
+        target[CodeCheckerResultsInfo].data
+        for target in ctx.attr.targets
+        if CodeCheckerResultsInfo in target
+    ]).to_list()
+    if not data:
+        fail("No CodeChecker analysis results for given targets!")
+    source_files = depset(transitive = [
+        target[CodeCheckerResultsInfo].source_files
+        for target in ctx.attr.targets
+        if CodeCheckerResultsInfo in target
+    ]).to_list()
+    source_files = _filter_skipped(source_files, ctx.attr.skip)
+
+    # Create CodeChecker skip (ignore) file
+    ctx.actions.write(
+        output = ctx.outputs.codechecker_skipfile,
+        content = "\n".join(ctx.attr.skip),
+        is_executable = False,
+    )
+    config_info = _config_flag_info(ctx)
+    codechecker_env = _codechecker_config_file(
+        ctx,
+        config_info,
+        ctx.outputs.codechecker_config,
+    )
+
+    # Parse analysis results
+    codechecker_files = ctx.actions.declare_directory(ctx.label.name + "/codechecker-files")
+    ctx.actions.expand_template(
+        template = ctx.file._codechecker_script_template,
+        output = ctx.outputs.codechecker_script,
+        is_executable = True,
+        substitutions = {
+            "{Mode}": "Parse",
+            "{Verbosity}": "DEBUG",
+            "{PythonPath}": python_path,
+            "{codechecker_bin}": CODECHECKER_BIN_PATH,
+            "{codechecker_skipfile}": ctx.outputs.codechecker_skipfile.path,
+            "{codechecker_config}": ctx.outputs.codechecker_config.path,
+            "{codechecker_files}": codechecker_files.path,
+            "{codechecker_data}": " ".join([folder.path for folder in data]),
+            "{codechecker_log}": ctx.outputs.codechecker_log.path,
+            "{codechecker_env}": codechecker_env,
+        },
+    )
+    ctx.actions.run(
+        inputs = depset(
+            [
+                ctx.outputs.codechecker_script,
+                ctx.outputs.codechecker_skipfile,
+                ctx.outputs.codechecker_config,
+            ] + data + source_files,
+        ),
+        outputs = [
+            codechecker_files,
+            ctx.outputs.codechecker_log,
+        ],
+        executable = ctx.outputs.codechecker_script,
+        arguments = [],
+        mnemonic = "CodeCheckerParse",
+        progress_message = "CodeChecker parse %s" % str(ctx.label),
+    )
+
+    # Optionally load results into SQLite index
+    codechecker_index = _index_results(ctx, codechecker_files)
+    index_files = [codechecker_index] if codechecker_index else []
+
+    # Create test script from template
+    ctx.actions.expand_template(
+        template = ctx.file._codechecker_script_template,
+        output = ctx.outputs.codechecker_test_script,
+        is_executable = True,
+        substitutions = {
+            "{Mode}": "Test",
+            "{Verbosity}": "INFO",
+            "{PythonPath}": python_path,
+            "{codechecker_bin}": CODECHECKER_BIN_PATH,
+            "{codechecker_files}": codechecker_files.short_path,
+            "{codechecker_index}": codechecker_index.short_path if codechecker_index else "",
+            "{codechecker_index_tool}": ctx.file._codechecker_index_script.short_path if codechecker_index else "",
+            "{Severities}": " ".join(ctx.attr.severities),
+        },
+    )
+
+    # Return test script and all required files
+    all_files = [
+        ctx.outputs.codechecker_skipfile,
+        ctx.outputs.codechecker_config,
+        ctx.outputs.codechecker_script,
+        ctx.outputs.codechecker_log,
+        codechecker_files,
+    ] + index_files
+    run_files = [
+        codechecker_files,
+        ctx.outputs.codechecker_test_script,
+    ] + index_files
+    if codechecker_index:
+        run_files.append(ctx.file._codechecker_index_script)
+    return [
+        DefaultInfo(
+            files = depset(all_files),
+            runfiles = ctx.runfiles(files = run_files),
+            executable = ctx.outputs.codechecker_test_script,
+        ),
+    ]
+
+_codechecker_library_test = rule(
+    implementation = _codechecker_library_test_impl,
+    attrs = {
+        "platform": attr.string(
+            default = "",  #"@platforms//os:linux",
+            doc = "Plaform to build for",
+        ),
+        "targets": attr.label_list(
+            aspects = [
+                compile_info_aspect,
+                compile_commands_aspect,
+                codechecker_aspect,
+            ],
+            cfg = platforms_transition,
+            doc = "List of compilable targets which should be checked.",
+        ),
+        "_whitelist_function_transition": attr.label(
+            default = "@bazel_tools//tools/whitelists/function_transition_whitelist",
+            doc = "needed for transitions",
+        ),
+        "_codechecker_config": attr.label(
+            default = ":codechecker_config",
+        ),
+        "_codechecker_script_template": attr.label(
+            default = ":codechecker_script.py",
+            allow_single_file = True,
+        ),
+        "index_file": attr.string(
+            default = "",
+            doc = "Local SQLite file (absolute path) to merge results into, see codechecker_index.py. " +
+                  "When set, results of the run are also indexed in codechecker_index.sqlite. " +
+                  "Must be writable from the sandbox, e.g. --sandbox_writable_path",
+        ),
+        "_codechecker_index": attr.label(
+            allow_files = True,
+            executable = True,
+            cfg = "host",
+            default = ":codechecker_index",
+        ),
+        "_codechecker_index_script": attr.label(
+            default = ":codechecker_index.py",
+            allow_single_file = True,
+        ),
+        "_python_runtime": attr.label(
+            default = "@default_python_tools//:py3_runtime",
+        ),
+        "severities": attr.string_list(
+            default = ["HIGH"],
+            doc = "List of defect severities: HIGH, MEDIUM, LOW, STYLE etc",
+        ),
+        "skip": attr.string_list(
+            default = [],
+            doc = "List of skip/ignore file rules. " +
+                  "See https://codechecker.readthedocs.io/en/latest/analyzer/user_guide/#skip-file",
+        ),
+    },
+    outputs = {
+        "codechecker_skipfile": "%{name}/codechecker_skipfile.cfg",
+        "codechecker_config": "%{name}/codechecker_config.json",
+        "codechecker_script": "%{name}/codechecker_script.py",
+        "codechecker_log": "%{name}/codechecker.log",
+        "codechecker_test_script": "%{name}/codechecker_test_script.py",
+    },
+    test = True,
+)
+
 def codechecker_test(
         name,
         targets,
@@ -386,12 +933,36 @@ def codechecker_test(
         skip = [],
         config = None,
         analyze = [],
+        stats_file = "",
+        outlier_factor = 0,
+        per_library = False,
+        index_file = "",
         tags = [],
         **kwargs):
-    """ Bazel test to run CodeChecker """
+    """ Bazel test to run CodeChecker
+
+    With per_library = True every library is analyzed once by
+    codechecker_aspect and shared by all tests, which only parse results.
+    Analysis is configured by @bazel_codechecker//src:codechecker_config flag.
+    """
     codechecker_tags = [] + tags
     if "codechecker" not in tags:
         codechecker_tags.append("codechecker")
+    if per_library:
+        if config or analyze or stats_file or outlier_factor:
+            fail("codechecker_test(per_library = True) does not support " +
+                 "config, analyze, stats_file and outlier_factor, " +
+                 "use @bazel_codechecker//src:codechecker_config flag")
+        _codechecker_library_test(
+            name = name,
+            platform = platform,
+            targets = targets,
+            severities = severities,
+            skip = skip,
+            index_file = index_file,
+            tags = codechecker_tags,
+        )
+        return
     _codechecker_test(
         name = name,
         platform = platform,
@@ -400,6 +971,9 @@ def codechecker_test(
         skip = skip,
         config = config,
         analyze = analyze,
+        stats_file = stats_file,
+        outlier_factor = outlier_factor,
+        index_file = index_file,
         tags = codechecker_tags,
     )
 
@@ -411,6 +985,10 @@ def codechecker_suite(
         skip = [],
         config = None,
         analyze = [],
+        stats_file = "",
+        outlier_factor = 0,
+        per_library = False,
+        index_file = "",
         tags = [],
         **kwargs):
     """ Bazel test suite to run CodeChecker for different platforms """
@@ -429,6 +1007,10 @@ def codechecker_suite(
             skip = skip,
             config = config,
             analyze = analyze,
+            stats_file = stats_file,
+            outlier_factor = outlier_factor,
+            per_library = per_library,
+            index_file = index_file,
             tags = tags,
         )
     native.test_suite(
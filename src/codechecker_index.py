@@ -0,0 +1,342 @@
+# Copyright 2023 Ericsson AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local SQLite index of CodeChecker results
+
+  load     - load CodeChecker parse JSON results (result.json) as a new run
+  query    - count or list reports by checker, severity and file
+  compare  - compare checker counts of the last run with an earlier one
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import logging
+import sqlite3
+import sys
+import time
+
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        timestamp REAL NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS reports (
+        hash TEXT PRIMARY KEY,
+        checker TEXT,
+        severity TEXT,
+        file TEXT,
+        line INTEGER,
+        col INTEGER,
+        message TEXT,
+        review_status TEXT,
+        first_run INTEGER,
+        last_run INTEGER)""",
+    """CREATE TABLE IF NOT EXISTS run_reports (
+        run_id INTEGER NOT NULL,
+        hash TEXT NOT NULL,
+        PRIMARY KEY (run_id, hash))""",
+    "CREATE INDEX IF NOT EXISTS reports_checker ON reports (checker)",
+    "CREATE INDEX IF NOT EXISTS reports_severity ON reports (severity)",
+    "CREATE INDEX IF NOT EXISTS reports_file ON reports (file)",
+    "CREATE INDEX IF NOT EXISTS run_reports_hash ON run_reports (hash)",
+    "CREATE INDEX IF NOT EXISTS runs_name ON runs (name, timestamp)",
+]
+
+# Reports with these review statuses are not counted as defects
+SUPPRESSED = ("false_positive", "intentional", "suppress", "suppressed")
+
+GROUP_BY = ["checker", "severity", "file"]
+
+
+def parse_args():
+    """
+    Parse command line arguments or show help.
+    """
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter,
+                                     description=__doc__)
+    parser.add_argument("-v", "--verbosity",
+                        default=0,
+                        action="count",
+                        help="increase output verbosity (e.g., -v or -vv)")
+    parser.add_argument("--log-format",
+                        default="[INDEX] %(levelname)5s: %(message)s",
+                        help=argparse.SUPPRESS)
+    commands = parser.add_subparsers(dest="command")
+
+    load = commands.add_parser("load", help="load CodeChecker results as a new run")
+    load.add_argument("-i", "--input",
+                      required=True,
+                      help="CodeChecker parse --export=json file")
+    load.add_argument("-d", "--database",
+                      required=True,
+                      help="SQLite database file, runs have zero timestamp")
+    load.add_argument("-l", "--local-database",
+                      default=None,
+                      help="local SQLite database file to merge results into,\n"
+                           "failures are only reported as warnings")
+    load.add_argument("-r", "--run",
+                      required=True,
+                      help="run name, e.g. Bazel label")
+
+    query = commands.add_parser("query", help="count or list reports")
+    query.add_argument("-d", "--database",
+                       required=True,
+                       help="SQLite database file")
+    query.add_argument("-r", "--run",
+                       default=None,
+                       help="run name (default: last run of any name)")
+    query.add_argument("-c", "--checker",
+                       default=None,
+                       help="checker name glob, e.g. core.*")
+    query.add_argument("-s", "--severity",
+                       default=None,
+                       help="severity, e.g. HIGH")
+    query.add_argument("-f", "--file",
+                       default=None,
+                       help="file path glob, e.g. */src/*")
+    query.add_argument("-g", "--group-by",
+                       default=None,
+                       choices=GROUP_BY,
+                       help="print report counts grouped by given field")
+
+    compare = commands.add_parser("compare", help="compare checker counts of two runs")
+    compare.add_argument("-d", "--database",
+                         required=True,
+                         help="SQLite database file")
+    compare.add_argument("-r", "--run",
+                         required=True,
+                         help="run name")
+    compare.add_argument("--days",
+                         default=None,
+                         type=float,
+                         help="compare with the last run at least that many days older "
+                              "(default: previous run)")
+
+    options = parser.parse_args()
+    if not options.command:
+        parser.error("command is required")
+
+    if options.verbosity >= 2:
+        log_level = logging.DEBUG
+    elif options.verbosity >= 1:
+        log_level = logging.INFO
+    else:
+        log_level = logging.WARN
+    logging.basicConfig(level=log_level, format=options.log_format)
+
+    return options
+
+
+def connect(database):
+    """
+    Open SQLite database and create tables and indexes if needed
+    """
+    connection = sqlite3.connect(database)
+    for statement in SCHEMA:
+        connection.execute(statement)
+    return connection
+
+
+def read_reports(filename):
+    """
+    Read reports from CodeChecker parse --export=json file
+    """
+    with open(filename, "r") as input_file:
+        data = json.load(input_file)
+    if isinstance(data, dict):
+        data = data.get("reports", [])
+    reports = []
+    for item in data:
+        source = item.get("file", "")
+        if isinstance(source, dict):
+            source = source.get("original_path") or source.get("path", "")
+        reports.append((
+            item.get("report_hash") or item.get("bug_hash"),
+            item.get("checker_name") or item.get("checkerId"),
+            item.get("severity"),
+            source,
+            item.get("line"),
+            item.get("column"),
+            item.get("message") or item.get("checkerMsg"),
+            item.get("review_status"),
+        ))
+    logging.info("Read %d reports from %s", len(reports), filename)
+    return reports
+
+
+def load(connection, run, reports, timestamp):
+    """
+    Add a new run and merge its reports by report hash
+
+    A known report keeps its first run, other columns are updated
+    from the new run (requires SQLite 3.24 or newer).
+    """
+    with connection:
+        cursor = connection.execute(
+            "INSERT INTO runs (name, timestamp) VALUES (?, ?)", (run, timestamp))
+        run_id = cursor.lastrowid
+        for report in reports:
+            connection.execute(
+                "INSERT INTO reports (hash, checker, severity, file, line, col,"
+                " message, review_status, first_run, last_run)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (hash) DO UPDATE SET checker = excluded.checker,"
+                " severity = excluded.severity, file = excluded.file,"
+                " line = excluded.line, col = excluded.col, message = excluded.message,"
+                " review_status = excluded.review_status, last_run = excluded.last_run",
+                report + (run_id, run_id))
+            connection.execute(
+                "INSERT OR IGNORE INTO run_reports (run_id, hash) VALUES (?, ?)",
+                (run_id, report[0]))
+    logging.info("Loaded run %s (%d) with %d reports", run, run_id, len(reports))
+    return run_id
+
+
+def last_run(connection, run=None, before=None):
+    """
+    Return id of the last run with given name (or any name), optionally before timestamp
+    """
+    query = "SELECT MAX(id) FROM runs WHERE 1"
+    parameters = []
+    if run:
+        query += " AND name = ?"
+        parameters.append(run)
+    if before:
+        query += " AND timestamp <= ?"
+        parameters.append(before)
+    return connection.execute(query, parameters).fetchone()[0]
+
+
+def count_severities(connection, run_id=None):
+    """
+    Return dict: severity -> number of unsuppressed reports in the run
+    """
+    if run_id is None:
+        run_id = last_run(connection)
+    rows = connection.execute(
+        "SELECT reports.severity, COUNT(*) FROM run_reports"
+        " JOIN reports ON reports.hash = run_reports.hash"
+        " WHERE run_reports.run_id = ?"
+        " AND IFNULL(reports.review_status, '') NOT IN (%s)"
+        " GROUP BY reports.severity" % ", ".join("?" * len(SUPPRESSED)),
+        (run_id,) + SUPPRESSED)
+    return dict(rows.fetchall())
+
+
+def count_checkers(connection, run_id):
+    """
+    Return dict: checker -> number of reports in the run
+    """
+    rows = connection.execute(
+        "SELECT reports.checker, COUNT(*) FROM run_reports"
+        " JOIN reports ON reports.hash = run_reports.hash"
+        " WHERE run_reports.run_id = ? GROUP BY reports.checker", (run_id,))
+    return dict(rows.fetchall())
+
+
+def query(connection, options):
+    """
+    Print reports or report counts of a run matching given filters
+    """
+    run_id = last_run(connection, options.run)
+    if run_id is None:
+        logging.error("No runs found")
+        return 1
+    conditions = ["run_reports.run_id = ?"]
+    parameters = [run_id]
+    if options.checker:
+        conditions.append("reports.checker GLOB ?")
+        parameters.append(options.checker)
+    if options.severity:
+        conditions.append("reports.severity = ?")
+        parameters.append(options.severity.upper())
+    if options.file:
+        conditions.append("reports.file GLOB ?")
+        parameters.append(options.file)
+    where = (" FROM run_reports JOIN reports ON reports.hash = run_reports.hash"
+             " WHERE " + " AND ".join(conditions))
+    if options.group_by:
+        rows = connection.execute(
+            "SELECT reports.%s, COUNT(*)" % options.group_by + where +
+            " GROUP BY reports.%s ORDER BY COUNT(*) DESC" % options.group_by,
+            parameters)
+        for value, count in rows:
+            print("%-60s %d" % (value, count))
+    else:
+        rows = connection.execute(
+            "SELECT reports.file, reports.line, reports.col, reports.severity,"
+            " reports.checker, reports.message" + where +
+            " ORDER BY reports.file, reports.line", parameters)
+        for row in rows:
+            print("%s:%s:%s: [%s] %s: %s" % row)
+    return 0
+
+
+def compare(connection, options):
+    """
+    Print checkers with changed report counts between two runs
+    """
+    current = last_run(connection, options.run)
+    if current is None:
+        logging.error("No runs found for %s", options.run)
+        return 1
+    if options.days is not None:
+        before = time.time() - options.days * 24 * 60 * 60
+        baseline = last_run(connection, options.run, before)
+    else:
+        baseline = connection.execute(
+            "SELECT MAX(id) FROM runs WHERE name = ? AND id < ?",
+            (options.run, current)).fetchone()[0]
+    if baseline is None:
+        logging.error("No earlier run found for %s", options.run)
+        return 1
+    old = count_checkers(connection, baseline)
+    new = count_checkers(connection, current)
+    changes = [(checker, old.get(checker, 0), new.get(checker, 0))
+               for checker in set(old) | set(new)
+               if old.get(checker, 0) != new.get(checker, 0)]
+    for checker, before, after in sorted(changes, key=lambda item: item[1] - item[2]):
+        print("%-60s %6d -> %6d (%+d)" % (checker, before, after, after - before))
+    return 0
+
+
+def main():
+    """
+    Main function
+    """
+    options = parse_args()
+    logging.debug("Options: %s", options)
+
+    if options.command == "load":
+        reports = read_reports(options.input)
+        # Fixed timestamp keeps Bazel output reproducible
+        load(connect(options.database), options.run, reports, 0)
+        if options.local_database:
+            try:
+                load(connect(options.local_database), options.run, reports, time.time())
+            except (sqlite3.Error, OSError) as error:
+                logging.warning("Cannot merge into %s: %s", options.local_database, error)
+        return 0
+
+    connection = connect(options.database)
+    if options.command == "query":
+        return query(connection, options)
+    return compare(connection, options)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,15 +4,23 @@ CodeChecker Bazel build & test wrapper script
 """
 
 from __future__ import print_function
+import filecmp
 import getpass
+import importlib.util
+import json
 import logging
+import math
 import multiprocessing
 import os
 import plistlib
 import re
 import shlex
+import shutil
+import sqlite3
 import subprocess
 import sys
+import time
+from multiprocessing.pool import ThreadPool
 
 
 EXECUTION_MODE = "{Mode}"
@@ -22,9 +30,14 @@ CODECHECKER_SKIPFILE = "{codechecker_skipfile}"
 CODECHECKER_CONFIG = "{codechecker_config}"
 CODECHECKER_ANALYZE = "{codechecker_analyze}"
 CODECHECKER_FILES = "{codechecker_files}"
+CODECHECKER_DATA = "{codechecker_data}"
+CODECHECKER_INDEX = "{codechecker_index}"
+CODECHECKER_INDEX_TOOL = "{codechecker_index_tool}"
 CODECHECKER_LOG = "{codechecker_log}"
 CODECHECKER_SEVERITIES = "{Severities}"
 CODECHECKER_ENV = "{codechecker_env}"
+CODECHECKER_STATS = "{codechecker_stats}"
+CODECHECKER_OUTLIER_FACTOR = "{codechecker_outlier_factor}"
 COMPILE_COMMANDS = "{compile_commands}"
 
 START_PATH = r"\/(?:(?!\.\s+)\S)+"
@@ -118,8 +131,13 @@ def input_data():
     logging.debug("CODECHECKER_CONFIG   : %s", str(CODECHECKER_CONFIG))
     logging.debug("CODECHECKER_ANALYZE  : %s", str(CODECHECKER_ANALYZE))
     logging.debug("CODECHECKER_FILES    : %s", str(CODECHECKER_FILES))
+    logging.debug("CODECHECKER_DATA     : %s", str(CODECHECKER_DATA))
+    logging.debug("CODECHECKER_INDEX    : %s", str(CODECHECKER_INDEX))
+    logging.debug("CODECHECKER_INDEX_TOOL : %s", str(CODECHECKER_INDEX_TOOL))
     logging.debug("CODECHECKER_LOG      : %s", str(CODECHECKER_LOG))
     logging.debug("CODECHECKER_ENV      : %s", str(CODECHECKER_ENV))
+    logging.debug("CODECHECKER_STATS    : %s", str(CODECHECKER_STATS))
+    logging.debug("CODECHECKER_OUTLIER_FACTOR : %s", str(CODECHECKER_OUTLIER_FACTOR))
     logging.debug("COMPILE_COMMANDS     : %s", str(COMPILE_COMMANDS))
     logging.debug("")
 
@@ -157,10 +175,26 @@ def prepare():
     create_folder(CODECHECKER_FILES)
 
 
-def analyze():
-    """ Run CodeChecker analyze command """
-    stage("CodeChecker analyze:")
+def stats_file_name():
+    """ Check and return stats file name """
+    if valid_parameter(CODECHECKER_STATS) and CODECHECKER_STATS:
+        return CODECHECKER_STATS
+    return None
+
+
+def outlier_factor():
+    """ Return outlier factor for analysis budget, 0 means no budget """
+    if not valid_parameter(CODECHECKER_OUTLIER_FACTOR):
+        return 0
+    try:
+        return float(CODECHECKER_OUTLIER_FACTOR)
+    except ValueError:
+        fail("Invalid outlier factor: %s" % CODECHECKER_OUTLIER_FACTOR)
+    return 0
 
+
+def analyze_env():
+    """ Return environment for CodeChecker analyze """
     env = os.environ
     if CODECHECKER_ENV:
         env_list = CODECHECKER_ENV.split("; ")
@@ -170,29 +204,344 @@ def analyze():
     if "PATH" not in env:
         env["PATH"] = "/bin"  # NOTE: this is workaround for CodeChecker 6.24.4
     logging.debug("env: %s", str(env))
+    return env
 
-    output = execute("%s analyzers --details" % CODECHECKER_PATH, env=env)
-    logging.debug("Analyzers:\n\n%s", output)
 
-    command = "%s analyze --skip=%s %s --output=%s/data --config %s %s" % (
+def analyze_command(compile_commands, output, timeout=None, jobs=None):
+    """ Return CodeChecker analyze command line """
+    command = "%s analyze --skip=%s %s --output=%s --config %s %s" % (
         CODECHECKER_PATH,
         CODECHECKER_SKIPFILE,
-        COMPILE_COMMANDS,
-        CODECHECKER_FILES,
+        compile_commands,
+        output,
         CODECHECKER_CONFIG,
         CODECHECKER_ANALYZE,
     )
     # FIXME: Workaround "CodeChecker simply remove compiler-rt include path".
     # This can be removed once codechecker 6.16.0 is used.
     # command += " --keep-gcc-intrin"
+    if timeout:
+        command += " --timeout=%d" % timeout
+    if jobs:
+        command += " --jobs=%d" % jobs
+    return command
+
+
+def analyze_failed(output):
+    """ Check if CodeChecker analyze output reports failed files """
+    return output.find("- Failed to analyze") != -1
+
+
+def analyze_timed_out(output):
+    """ Check if CodeChecker analyze output reports exceeded --timeout """
+    return re.search(r"exceeding time limit|Analysis timed out", output) is not None
+
+
+def timeouts_file_name():
+    """ Return file name to list files with analysis budget exceeded """
+    return CODECHECKER_FILES + "/timeouts.txt"
+
+
+def save_timeouts(filenames):
+    """ Save list of files with incomplete analysis results """
+    with open(timeouts_file_name(), "w") as output_file:
+        for filename in filenames:
+            output_file.write(filename + "\n")
+
+
+def load_timeouts():
+    """ Return list of files with incomplete analysis results """
+    if not os.path.isfile(timeouts_file_name()):
+        return []
+    return read_file(timeouts_file_name()).split()
+
+
+def analyze_jobs():
+    """ Return number of parallel jobs from CodeChecker analyze arguments """
+    match = re.search(r"(?:^|\s)(?:-j|--jobs)[=\s]*(\d+)", CODECHECKER_ANALYZE)
+    if match:
+        return max(1, int(match.group(1)))
+    return multiprocessing.cpu_count()
+
+
+def ctu_enabled():
+    """ Check if CTU analysis is requested in arguments or config file """
+    if "--ctu" in shlex.split(CODECHECKER_ANALYZE):
+        return True
+    try:
+        config = json.loads(read_file(CODECHECKER_CONFIG))
+    except ValueError:
+        return False
+    return any(arg.startswith("--ctu") for arg in config.get("analyze", []))
+
+
+def load_stats():
+    """ Load per-TU analysis durations (in seconds) from previous runs """
+    filename = stats_file_name()
+    if not os.path.isfile(filename):
+        logging.info("No analysis stats found in %s", filename)
+        return {}
+    try:
+        with open(filename) as stats_file:
+            stats = json.load(stats_file)
+        return stats.get("durations", {})
+    except (IOError, ValueError) as error:
+        logging.warning("Ignoring analysis stats %s: %s", filename, error)
+    return {}
+
+
+def save_stats(durations):
+    """ Save per-TU analysis durations for the next run """
+    filename = stats_file_name()
+    logging.info("Saving analysis stats to %s", filename)
+    try:
+        with open(filename + ".tmp", "w") as stats_file:
+            json.dump({"version": 1, "durations": durations}, stats_file,
+                      indent=4, sort_keys=True)
+        os.rename(filename + ".tmp", filename)
+    except (IOError, OSError) as error:
+        logging.warning("Cannot save analysis stats %s: %s", filename, error)
+
+
+def schedule(compile_commands, durations):
+    """ Order compile commands longest-first by previous analysis durations
+
+    Translation units without history go first, their duration is unknown.
+    """
+    return sorted(
+        compile_commands,
+        key=lambda entry: -durations.get(entry["file"], float("inf")))
+
+
+def analysis_budget(compile_commands, durations):
+    """ Return timeout in seconds for known outliers or None """
+    factor = outlier_factor()
+    known = sorted(
+        durations[entry["file"]] for entry in compile_commands
+        if entry["file"] in durations)
+    if not factor or not known:
+        return None
+    median = known[len(known) // 2]
+    return max(1, int(math.ceil(factor * median)))
+
+
+def find_outliers(compile_commands, durations, budget):
+    """ Return files which took longer than analysis budget in previous runs """
+    if not budget:
+        return []
+    return [entry["file"] for entry in compile_commands
+            if durations.get(entry["file"], 0) > budget]
+
+
+def source_file_matches(source, filename):
+    """ Check if absolute source path from CodeChecker matches compile command file """
+    return source == filename or source.endswith("/" + filename)
+
+
+def estimate_durations(compile_commands, data_folder, start, jobs):
+    """ Estimate per-file analysis durations of a single CodeChecker analyze run
+
+    Each analyzer action writes a result file listed in metadata.json.
+    With greedy scheduling on given number of jobs, the action finished
+    in place N started when the action in place N - jobs finished.
+    """
+    try:
+        with open(os.path.join(data_folder, "metadata.json")) as metadata_file:
+            tools = json.load(metadata_file).get("tools", [])
+    except (IOError, ValueError, AttributeError) as error:
+        logging.warning("Cannot estimate analysis durations: %s", error)
+        return {}
+    finished = []
+    for tool in tools:
+        for result, source in tool.get("result_source_files", {}).items():
+            if not os.path.isfile(result):
+                result = os.path.join(data_folder, os.path.basename(result))
+            if os.path.isfile(result):
+                finished.append((os.path.getmtime(result), source))
+    finished.sort()
+    durations = {}
+    for place, (end, source) in enumerate(finished):
+        begin = finished[place - jobs][0] if place >= jobs else start
+        for entry in compile_commands:
+            if source_file_matches(source, entry["file"]):
+                filename = entry["file"]
+                durations[filename] = round(
+                    durations.get(filename, 0) + max(0, end - begin), 3)
+                break
+    return durations
+
+
+def analyze_translation_unit(task):
+    """ Run CodeChecker analyze for a single translation unit in one job """
+    compile_commands, output, timeout, env = task
+    command = analyze_command(compile_commands, output, timeout, jobs=1)
+    start = time.time()
+    process = subprocess.Popen(
+        command,
+        env=env,
+        shell=True,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    stdout, _ = process.communicate()
+    return time.time() - start, process.returncode, stdout.decode("utf-8")
+
+
+def merge_results(source, destination):
+    """ Move analysis results of a translation unit into common output folder
+
+    Returns:
+      List of dropped files which differ from the already merged copy
+    """
+    collisions = []
+    for root, _, files in os.walk(source):
+        folder = os.path.join(destination, os.path.relpath(root, source))
+        create_folder(folder)
+        for filename in files:
+            path = os.path.join(root, filename)
+            target = os.path.join(folder, filename)
+            if filename == "metadata.json" and os.path.exists(target):
+                merge_metadata(path, target)
+            elif not os.path.exists(target):
+                os.rename(path, target)
+            elif filecmp.cmp(path, target, shallow=False):
+                logging.debug("Skipping identical %s", path)
+            else:
+                collisions.append(os.path.relpath(target, destination))
+    return collisions
+
+
+def merge_metadata(source, destination):
+    """ Merge result source files of CodeChecker metadata.json files """
+    try:
+        with open(source) as source_file:
+            source_tools = json.load(source_file).get("tools", [])
+        with open(destination) as destination_file:
+            metadata = json.load(destination_file)
+        tools = metadata.get("tools", [])
+        for tool, source_tool in zip(tools, source_tools):
+            tool.setdefault("result_source_files", {}).update(
+                source_tool.get("result_source_files", {}))
+        with open(destination, "w") as destination_file:
+            json.dump(metadata, destination_file, indent=4)
+    except (IOError, ValueError, AttributeError) as error:
+        logging.warning("Cannot merge %s: %s", source, error)
+
+
+def analyze_all(compile_commands, env):
+    """ Run CodeChecker analyze for the whole compilation database """
+    command = analyze_command(compile_commands, CODECHECKER_FILES + "/data")
     logging.info("Running CodeChecker analyze...")
     output = execute(command, env=env)
     logging.info("Output:\n\n%s\n", output)
-    if output.find("- Failed to analyze") != -1:
+    if analyze_failed(output):
         logging.error("CodeChecker failed to analyze some files")
         fail("Make sure that the target can be built first")
 
 
+def analyze_scheduled(compile_commands, durations, env):
+    """ Run CodeChecker analyze once for reordered compilation database """
+    scheduled_commands = CODECHECKER_FILES + "/compile_commands.json"
+    with open(scheduled_commands, "w") as output_file:
+        json.dump(compile_commands, output_file, indent=4)
+    start = time.time()
+    analyze_all(scheduled_commands, env)
+    durations.update(estimate_durations(
+        compile_commands, CODECHECKER_FILES + "/data", start, analyze_jobs()))
+
+
+def analyze_split(compile_commands, durations, budget, outliers, env):
+    """ Run CodeChecker analyze for known outliers separately with timeout
+
+    Other translation units are analyzed by a single reordered call,
+    then each outlier by its own single job call with --timeout.
+    Timed out outliers are listed in timeouts.txt and their duration is
+    capped to the budget, so the next run analyzes them completely again.
+    """
+    logging.info("Analysis budget for outliers: %d sec", budget)
+    for filename in outliers:
+        logging.info("    outlier: %8.1f sec  %s", durations[filename], filename)
+
+    regular = [entry for entry in compile_commands if entry["file"] not in outliers]
+    if regular:
+        analyze_scheduled(regular, durations, env)
+
+    tu_folder = CODECHECKER_FILES + "/tu"
+    create_folder(tu_folder)
+    entries = [entry for entry in compile_commands if entry["file"] in outliers]
+    tasks = []
+    for index, entry in enumerate(entries):
+        tu_compile_commands = os.path.join(tu_folder, "%d.json" % index)
+        with open(tu_compile_commands, "w") as output_file:
+            json.dump([entry], output_file, indent=4)
+        output = os.path.join(tu_folder, str(index))
+        tasks.append((tu_compile_commands, output, budget, env))
+
+    jobs = min(analyze_jobs(), len(tasks))
+    logging.info("Running CodeChecker analyze for %d outliers in %d jobs...",
+                 len(tasks), jobs)
+    pool = ThreadPool(jobs)
+    results = pool.map(analyze_translation_unit, tasks, 1)
+    pool.close()
+    pool.join()
+
+    failed = []
+    timeouts = []
+    collisions = []
+    for entry, task, result in zip(entries, tasks, results):
+        filename = entry["file"]
+        duration, returncode, output = result
+        logging.info("Output for %s (%.1f sec):\n\n%s\n", filename, duration, output)
+        if returncode == 0 and not analyze_failed(output):
+            durations[filename] = round(duration, 3)
+        elif analyze_timed_out(output):
+            logging.warning("Analysis budget exceeded: %s", filename)
+            durations[filename] = min(round(duration, 3), budget)
+            timeouts.append(filename)
+        else:
+            failed.append(filename)
+        collisions += merge_results(task[1], CODECHECKER_FILES + "/data")
+    shutil.rmtree(tu_folder)
+    for collision in sorted(set(collisions)):
+        logging.warning("Kept first of different copies: %s", collision)
+    save_timeouts(timeouts)
+    if failed:
+        save_stats(durations)
+        logging.error("CodeChecker failed to analyze: %s", ", ".join(failed))
+        fail("Make sure that the target can be built first")
+
+
+def analyze():
+    """ Run CodeChecker analyze command """
+    stage("CodeChecker analyze:")
+
+    env = analyze_env()
+
+    output = execute("%s analyzers --details" % CODECHECKER_PATH, env=env)
+    logging.debug("Analyzers:\n\n%s", output)
+
+    if not stats_file_name():
+        analyze_all(COMPILE_COMMANDS, env)
+        return
+
+    # Schedule the slowest translation units first
+    durations = load_stats()
+    compile_commands = schedule(json.loads(read_file(COMPILE_COMMANDS)), durations)
+    budget = analysis_budget(compile_commands, durations)
+    outliers = find_outliers(compile_commands, durations, budget)
+    if ctu_enabled():
+        # CTU analysis needs the whole compilation database at once
+        logging.info("CTU analysis: reordering compilation database only")
+        analyze_scheduled(compile_commands, durations, env)
+    elif outliers:
+        # Only known outliers need separate analysis with timeout
+        analyze_split(compile_commands, durations, budget, outliers, env)
+    else:
+        analyze_scheduled(compile_commands, durations, env)
+    save_stats(durations)
+
+
 def fix_bazel_paths():
     """ Remove Bazel leading paths in all files """
     stage("Fix CodeChecker output:")
@@ -294,14 +643,18 @@ def update_file_paths():
     resolve_symlinks()
 
 
-def parse():
+def parse(data_folders=None, skipfile=None):
     """ Run CodeChecker parse commands """
     stage("CodeChecker parse:")
     logging.info("CodeChecker parse -e json")
+    if not data_folders:
+        data_folders = [CODECHECKER_FILES + "/data"]
     codechecker_parse = "{codechecker} parse --config {config} {output}".format(
         codechecker=CODECHECKER_PATH,
         config=CODECHECKER_CONFIG,
-        output=CODECHECKER_FILES + "/data")
+        output=" ".join(data_folders))
+    if skipfile:
+        codechecker_parse += " --skip " + skipfile
     # Save results to JSON file
     command = codechecker_parse + " --export=json > " + CODECHECKER_FILES + "/result.json"
     execute(command, codes=[0, 2])
@@ -314,6 +667,13 @@ def parse():
     logging.info("CodeChecker parse to text result")
     command = codechecker_parse + " > " + CODECHECKER_FILES + "/result.txt"
     execute(command, codes=[0, 2])
+    timeouts = load_timeouts()
+    if timeouts:
+        # Results of these files are incomplete, see check_results()
+        with open(CODECHECKER_FILES + "/result.txt", "a") as result_file:
+            result_file.write("\nAnalysis budget exceeded, results are incomplete:\n")
+            for filename in timeouts:
+                result_file.write("TIMEOUT %s\n" % filename)
     logging.info("Result:\n\n%s\n", read_file(CODECHECKER_FILES + "/result.txt"))
 
 
@@ -325,6 +685,68 @@ def run():
     update_file_paths()
 
 
+def relative_file_paths():
+    """ Make file paths in analysis output relative to execution root """
+    stage("Relative file paths in CodeChecker analyze output:")
+    folder = CODECHECKER_FILES + "/data"
+    prefix = os.getcwd() + "/"
+    logging.info("Removing %s from file paths in %s", prefix, folder)
+    counter = 0
+    for root, _, files in os.walk(folder):
+        for filename in files:
+            if os.path.splitext(filename)[1] not in [".plist", ".yaml", ".json"]:
+                continue
+            fullpath = os.path.join(root, filename)
+            with open(fullpath, "rt") as data_file:
+                data = data_file.read()
+            if prefix in data:
+                with open(fullpath, "w") as data_file:
+                    data_file.write(data.replace(prefix, ""))
+                counter += 1
+    logging.info("Updated file paths in %d files", counter)
+
+
+def analyze_only():
+    """ Perform analysis of a single library for "bazel build" phase """
+    prepare()
+    analyze()
+    # Results are parsed by another action, in another sandbox
+    relative_file_paths()
+
+
+def merge():
+    """ Parse analysis results of all libraries for "bazel build" phase """
+    if not valid_parameter(CODECHECKER_DATA) or not CODECHECKER_DATA:
+        fail("No CodeChecker analysis results to parse")
+    prepare()
+    parse(shlex.split(CODECHECKER_DATA), CODECHECKER_SKIPFILE)
+    update_file_paths()
+
+
+def index_file_name():
+    """ Check and return results index file name """
+    if valid_parameter(CODECHECKER_INDEX) and CODECHECKER_INDEX:
+        return CODECHECKER_INDEX
+    return None
+
+
+def index_severities(filename):
+    """ Count unsuppressed defects by severity in results index
+
+    Uses count_severities() from codechecker_index.py
+    """
+    logging.info("      results index: %s", filename)
+    if not valid_parameter(CODECHECKER_INDEX_TOOL) or not CODECHECKER_INDEX_TOOL:
+        fail("Results index tool is not available")
+    spec = importlib.util.spec_from_file_location("codechecker_index", CODECHECKER_INDEX_TOOL)
+    codechecker_index = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(codechecker_index)
+    connection = sqlite3.connect("file:%s?mode=ro" % filename, uri=True)
+    severities = codechecker_index.count_severities(connection)
+    connection.close()
+    return severities
+
+
 def check_results():
     """ Check/verify CodeChecker results """
     stage("Checking result:")
@@ -349,12 +771,23 @@ def check_results():
     logging.debug("Severities: %s", str(severities))
     issues = dict.fromkeys(severities, 0)
     logging.debug("Issues: %s", str(issues))
-    # Grep results for defects according to severities
-    for issue in issues:
-        found = re.findall(r"^%s .* (\d+)" % issue, results, re.M)
-        defects = sum([int(number) for number in found])
-        logging.debug("   %s : %s = %d", issue, str(found), defects)
-        issues[issue] = defects
+    if index_file_name():
+        # Count defects according to severities in results index
+        counts = index_severities(index_file_name())
+        for issue in issues:
+            issues[issue] = counts.get(issue, 0)
+    else:
+        # Grep results for defects according to severities
+        for issue in issues:
+            found = re.findall(r"^%s .* (\d+)" % issue, results, re.M)
+            defects = sum([int(number) for number in found])
+            logging.debug("   %s : %s = %d", issue, str(found), defects)
+            issues[issue] = defects
+    # Files with exceeded analysis budget have incomplete results,
+    # they are analyzed completely by the next run (see analyze_split)
+    timeouts = re.findall(r"^TIMEOUT (\S+)", results, re.M)
+    if timeouts:
+        logging.warning("Incomplete analysis: %s", ", ".join(timeouts))
     logging.info("Defects: %s", str(issues))
     # Check collected defects
     passed = True
@@ -381,6 +814,10 @@ def main():
     try:
         if EXECUTION_MODE == "Run":
             run()
+        elif EXECUTION_MODE == "Analyze":
+            analyze_only()
+        elif EXECUTION_MODE == "Parse":
+            merge()
         elif EXECUTION_MODE == "Test":
             test()
         else:
@@ -28,16 +28,16 @@ Implementation is based on two sources:
 compile_commands() rule - generates Bazel-native compile_commands.json file.
 It uses compile_commands_aspect to collect all sources and compile-time info
 for given targets and platform, then just saves to JSON file.
+
+Toolchain flags are taken from CompileInfo when compile_info_aspect
+is listed before compile_commands_aspect, see compile_info.bzl
 """
 
 load(
-    "@bazel_tools//tools/cpp:toolchain_utils.bzl",
-    "find_cpp_toolchain",
-)
-load(
-    "@bazel_tools//tools/build_defs/cc:action_names.bzl",
-    "CPP_COMPILE_ACTION_NAME",
-    "C_COMPILE_ACTION_NAME",
+    "compile_info.bzl",
+    "CompileInfo",
+    "compile_info_aspect",
+    "toolchain_flags",
 )
 
 SourceFilesInfo = provider(
@@ -45,7 +45,8 @@ SourceFilesInfo = provider(
     fields = {
         "transitive_source_files": "list of transitive source files of a target",
         "compilation_db": "list of compile commands with parameters: file, command, directory",
-        "headers": "list of required header files",
+        "direct_compilation_db": "list of compile commands of the target itself (without dependencies)",
+        "headers": "depset of required header files",
     },
 )
 
@@ -133,53 +134,26 @@ def _is_cpp_target(srcs):
     return any([src.extension in _cpp_extensions for src in srcs])
 
 # Function copied from https://github.com/grailbio/bazel-compilation-database/blob/master/aspects.bzl
-def _cc_compiler_info(ctx, target, srcs, feature_configuration, cc_toolchain):
-    compile_variables = None
+# NOTE: toolchain flags are computed by toolchain_flags() from compile_info.bzl
+def _cc_compiler_info(ctx, target, srcs, toolchain):
     compiler_options = None
-    compiler = None
     compile_flags = None
     force_language_mode_option = ""
 
     # This is useful for compiling .h headers as C++ code.
     if _is_cpp_target(srcs):
-        compile_variables = cc_common.create_compile_variables(
-            feature_configuration = feature_configuration,
-            cc_toolchain = cc_toolchain,
-            user_compile_flags = ctx.fragments.cpp.cxxopts +
-                                 ctx.fragments.cpp.copts,
-            add_legacy_cxx_options = True,
-        )
-        compiler_options = cc_common.get_memory_inefficient_command_line(
-            feature_configuration = feature_configuration,
-            action_name = CPP_COMPILE_ACTION_NAME,
-            variables = compile_variables,
-        )
+        compiler_options = toolchain.cxx_flags
         force_language_mode_option = " -x c++"
     else:
-        compile_variables = cc_common.create_compile_variables(
-            feature_configuration = feature_configuration,
-            cc_toolchain = cc_toolchain,
-            user_compile_flags = ctx.fragments.cpp.copts,
-        )
-        compiler_options = cc_common.get_memory_inefficient_command_line(
-            feature_configuration = feature_configuration,
-            action_name = C_COMPILE_ACTION_NAME,
-            variables = compile_variables,
-        )
+        compiler_options = toolchain.c_flags
 
-    compiler = str(
-        cc_common.get_tool_for_action(
-            feature_configuration = feature_configuration,
-            action_name = C_COMPILE_ACTION_NAME,
-        ),
-    )
+    compiler = str(toolchain.compiler)
 
     compile_flags = (compiler_options +
                      get_compile_flags(target) +
                      (ctx.rule.attr.copts if "copts" in dir(ctx.rule.attr) else []))
 
     return struct(
-        compile_variables = compile_variables,
         compiler_options = compiler_options,
         compiler = compiler,
         compile_flags = compile_flags,
@@ -195,24 +169,22 @@ def get_compilation_database(target, ctx):
     if ctx.rule.kind not in _cc_rules:
         return []
 
-    cc_toolchain = find_cpp_toolchain(ctx)
-    feature_configuration = cc_common.configure_features(
-        ctx = ctx,
-        cc_toolchain = cc_toolchain,
-        requested_features = ctx.features,
-        unsupported_features = ctx.disabled_features,
-    )
+    # Reuse toolchain flags of compile_info_aspect if available
+    if CompileInfo in target and target[CompileInfo].toolchain:
+        toolchain = target[CompileInfo].toolchain
+    else:
+        toolchain = toolchain_flags(ctx)
 
     srcs = get_sources(ctx)
 
-    compiler_info = _cc_compiler_info(ctx, target, srcs, feature_configuration, cc_toolchain)
+    compiler_info = _cc_compiler_info(ctx, target, srcs, toolchain)
 
     compile_flags = compiler_info.compile_flags
     compile_flags += [
         # Use -I to indicate that we want to keep the normal position in the system include chain.
         # See https://github.com/grailbio/bazel-compilation-database/issues/36#issuecomment-531971361.
         "-I " + str(d)
-        for d in cc_toolchain.built_in_include_directories
+        for d in toolchain.built_in_include_directories
     ]
     compile_command = compiler_info.compiler + " " + " ".join(compile_flags) + compiler_info.force_language_mode_option
 
@@ -239,10 +211,9 @@ def collect_headers(target, ctx):
       depset of header files
     """
     if CcInfo in target:
-        headers = [target[CcInfo].compilation_context.headers]
+        headers = target[CcInfo].compilation_context.headers
     else:
-        headers = []
-    headers = depset(headers)
+        headers = depset()
     for attr in _source_attr:
         if hasattr(ctx.rule.attr, attr):
             deps = getattr(ctx.rule.attr, attr)
@@ -278,8 +249,8 @@ def _accumulate_compilation_database(accumulated, deps):
 def _compile_commands_aspect_impl(target, ctx):
     source_files = get_sources(ctx)
     source_files = depset(source_files)
-    compilation_db = get_compilation_database(target, ctx)
-    compilation_db = depset(compilation_db)
+    direct_compilation_db = get_compilation_database(target, ctx)
+    compilation_db = depset(direct_compilation_db)
 
     for attr in _source_attr:
         if hasattr(ctx.rule.attr, attr):
@@ -296,6 +267,7 @@ def _compile_commands_aspect_impl(target, ctx):
         SourceFilesInfo(
             transitive_source_files = source_files,
             compilation_db = compilation_db,
+            direct_compilation_db = direct_compilation_db,
             headers = collect_headers(target, ctx),
         ),
     ]
@@ -303,11 +275,14 @@ def _compile_commands_aspect_impl(target, ctx):
 compile_commands_aspect = aspect(
     implementation = _compile_commands_aspect_impl,
     attr_aspects = _source_attr,
+    # Advertise SourceFilesInfo to aspects listed after this one, e.g. codechecker_aspect
+    provides = [SourceFilesInfo],
     attrs = {
         "_cc_toolchain": attr.label(
             default = Label("@bazel_tools//tools/cpp:current_cc_toolchain"),
         ),
     },
+    required_aspect_providers = [CompileInfo],
     fragments = ["cpp"],
     toolchains = ["@bazel_tools//tools/cpp:toolchain_type"],
 )
@@ -364,8 +339,7 @@ def compile_commands_impl(ctx):
         source_files += src.to_list()
         cdb = target[SourceFilesInfo].compilation_db
         compilation_db += cdb.to_list()
-        hdr = target[SourceFilesInfo].headers
-        headers += hdr.to_list()
+        headers.append(target[SourceFilesInfo].headers)
 
     # Check that compilation database is not empty
     if not len(compilation_db):
@@ -404,6 +378,7 @@ _compile_commands = rule(
         ),
         "targets": attr.label_list(
             aspects = [
+                compile_info_aspect,
                 compile_commands_aspect,
             ],
             cfg = platforms_transition,
@@ -60,6 +60,9 @@ def parse_args():
     parser.add_argument("-o", "--output",
                         default="compile_commands.json",
                         help="output compile_commands.json file")
+    parser.add_argument("-s", "--skipfile",
+                        default=None,
+                        help="CodeChecker skipfile, skipped entries are removed")
     parser.add_argument("-v", "--verbosity",
                         default=0,
                         action="count",
@@ -122,6 +125,76 @@ def filter_compile_flags(compile_commands):
     return compile_commands
 
 
+def compile_skip_rule(pattern):
+    """
+    Compile skipfile glob pattern to regular expression.
+    Returns None for patterns not starting with "*" (CodeChecker matches
+    them against absolute paths, unknown here) and for patterns with
+    wildcards other than "*", these are left to CodeChecker.
+    """
+    if not pattern.startswith("*") or "?" in pattern or "[" in pattern:
+        return None
+    return re.compile("^" + ".*".join(re.escape(part) for part in pattern.split("*")) + "$",
+                      re.DOTALL)
+
+
+def load_skip_rules(skipfile):
+    """
+    Read CodeChecker skipfile and precompile its +/- rules
+    """
+    rules = []
+    with open(skipfile, "r") as input_file:
+        for line in input_file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            sign, pattern = line[0], line[1:]
+            regex = compile_skip_rule(pattern) if sign in "+-" else None
+            rules.append((sign, regex))
+            if not regex:
+                logging.info("Skip rule is left to CodeChecker: %s", line)
+                # Next rules cannot be applied before this one
+                break
+    logging.debug("Skip rules: %s", rules)
+    return rules
+
+
+def is_skipped(filename, rules):
+    """
+    Check if file is skipped: the first matching rule wins.
+    Paths are matched with leading "/", as the end of absolute paths in
+    CodeChecker: a rule starting with "*" which matches here matches the
+    absolute path too, but a rule which does not match here still may.
+    So files are only skipped when CodeChecker would skip them as well.
+    """
+    if not filename.startswith("/"):
+        filename = "/" + filename
+    for sign, regex in rules:
+        if not regex:
+            return False
+        if regex.match(filename):
+            return sign == "-"
+        if sign == "+":
+            # CodeChecker may keep the file by this rule
+            return False
+    return False
+
+
+def filter_skipped(compile_commands, rules):
+    """
+    Remove compile commands for skipped files
+    """
+    logging.info("Filtering skipped files")
+    filtered = []
+    for item in compile_commands:
+        if is_skipped(item["file"], rules):
+            logging.debug("skipping: %s", item["file"])
+        else:
+            filtered.append(item)
+    logging.info("Skipped %d files", len(compile_commands) - len(filtered))
+    return filtered
+
+
 def main():
     """
     Main function
@@ -137,6 +210,10 @@ def main():
 
     # compile_commands = filter_compile_flags(compile_commands)
 
+    if options.skipfile:
+        rules = load_skip_rules(options.skipfile)
+        compile_commands = filter_skipped(compile_commands, rules)
+
     logging.debug("Converted compile commands:\n\n%s\n", compile_commands)
     logging.info("Saving to: %s", options.output)
     with open(options.output, "w") as output_file:
@@ -0,0 +1,331 @@
+# Copyright 2023 Ericsson AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" compile_info_aspect() and CompileInfo provider
+
+compile_info_aspect() - collects transitive source files and compile-time
+information shared by clang-tidy, clang -analyze, clang CTU, CodeChecker
+--file rules and compile_commands_aspect().
+
+Toolchain command line is computed once per configuration by the
+cc_toolchain_flags rule and shared by all targets which request the same
+features; targets with their own features compute it themselves.
+CompileInfo only keeps references to the toolchain flags, rule copts and
+compilation context: use compile_info_arguments() to build arguments
+of a target when they are needed.
+
+Aspects which reuse CompileInfo should declare
+required_aspect_providers = [CompileInfo] and be listed after
+compile_info_aspect, e.g.: aspects = [compile_info_aspect, your_aspect]
+"""
+
+load("@bazel_tools//tools/build_defs/cc:action_names.bzl", "ACTION_NAMES")
+load("@bazel_tools//tools/cpp:toolchain_utils.bzl", "find_cpp_toolchain")
+
+CompileInfo = provider(
+    doc = "Source files and corresponding compilation arguments",
+    fields = {
+        "sources": "depset of transitive source files",
+        "tidy_sources": "depset of transitive source files of targets accepted by valid_compile_target()",
+        "toolchain": "struct returned by toolchain_flags() or None",
+        "rule_flags": "list of copts of the rule",
+        "compilation_context": "compilation context of the target or None",
+    },
+)
+
+CcToolchainFlagsInfo = provider(
+    doc = "Toolchain flags of the configuration",
+    fields = {
+        "toolchain": "struct returned by toolchain_flags()",
+    },
+)
+
+_source_attr = [
+    "srcs",
+    "deps",
+    "data",
+    "exports",
+]
+
+_c_extensions = [
+    "c",
+    "C",
+]
+
+def rule_sources(ctx):
+    """ Return a list of C/C++ source and header files of the rule
+
+    Returns:
+      List of source files.
+    """
+
+    def check_valid_file_type(src):
+        """
+        Returns True if the file type matches one of the permitted srcs file types for C and C++ header/source files.
+        """
+        permitted_file_types = [
+            ".c",
+            ".cc",
+            ".cpp",
+            ".cxx",
+            ".c++",
+            ".C",
+            ".h",
+            ".hh",
+            ".hpp",
+            ".hxx",
+            ".inc",
+            ".inl",
+            ".H",
+        ]
+        for file_type in permitted_file_types:
+            if src.basename.endswith(file_type):
+                return True
+        return False
+
+    srcs = []
+    if hasattr(ctx.rule.attr, "srcs"):
+        for src in ctx.rule.attr.srcs:
+            srcs += [src for src in src.files.to_list() if src.is_source and check_valid_file_type(src)]
+    return srcs
+
+def safe_flags(flags):
+    """ Return flags without those not understood by Clang
+
+    Returns:
+      List of flags.
+    """
+
+    # Some flags might be used by GCC, but not understood by Clang.
+    # Remove them here, to allow users to run analysis, without having
+    # a clang toolchain configured (that would produce a good command line with --compiler clang)
+    unsupported_flags = [
+        "-fno-canonical-system-headers",
+        "-fstack-usage",
+    ]
+
+    return [flag for flag in flags if flag not in unsupported_flags]
+
+def toolchain_flags(ctx):
+    """ Return compiler and toolchain flags for C and C++ compile actions
+
+    Features are configured once and reused for both actions.
+    Flags are the same as Bazel uses to compile C and C++ sources:
+    --copt for C, --cxxopt and --copt (and legacy C++ options) for C++.
+
+    Returns:
+      struct(compiler, cxx_compiler, c_flags, cxx_flags,
+             built_in_include_directories, features, disabled_features)
+    """
+    cc_toolchain = find_cpp_toolchain(ctx)
+    feature_configuration = cc_common.configure_features(
+        ctx = ctx,
+        cc_toolchain = cc_toolchain,
+        requested_features = ctx.features,
+        unsupported_features = ctx.disabled_features,
+    )
+    c_variables = cc_common.create_compile_variables(
+        feature_configuration = feature_configuration,
+        cc_toolchain = cc_toolchain,
+        user_compile_flags = ctx.fragments.cpp.copts,
+    )
+    cxx_variables = cc_common.create_compile_variables(
+        feature_configuration = feature_configuration,
+        cc_toolchain = cc_toolchain,
+        user_compile_flags = ctx.fragments.cpp.cxxopts + ctx.fragments.cpp.copts,
+        add_legacy_cxx_options = True,
+    )
+    c_flags = cc_common.get_memory_inefficient_command_line(
+        feature_configuration = feature_configuration,
+        action_name = ACTION_NAMES.c_compile,
+        variables = c_variables,
+    )
+    cxx_flags = cc_common.get_memory_inefficient_command_line(
+        feature_configuration = feature_configuration,
+        action_name = ACTION_NAMES.cpp_compile,
+        variables = cxx_variables,
+    )
+    compiler = cc_common.get_tool_for_action(
+        feature_configuration = feature_configuration,
+        action_name = ACTION_NAMES.c_compile,
+    )
+    cxx_compiler = cc_common.get_tool_for_action(
+        feature_configuration = feature_configuration,
+        action_name = ACTION_NAMES.cpp_compile,
+    )
+    return struct(
+        compiler = compiler,
+        cxx_compiler = cxx_compiler,
+        c_flags = c_flags,
+        cxx_flags = cxx_flags,
+        built_in_include_directories = cc_toolchain.built_in_include_directories,
+        features = ctx.features,
+        disabled_features = ctx.disabled_features,
+    )
+
+def _cc_toolchain_flags_impl(ctx):
+    return [CcToolchainFlagsInfo(toolchain = toolchain_flags(ctx))]
+
+cc_toolchain_flags = rule(
+    implementation = _cc_toolchain_flags_impl,
+    fragments = ["cpp"],
+    attrs = {
+        "_cc_toolchain": attr.label(default = Label("@bazel_tools//tools/cpp:current_cc_toolchain")),
+    },
+    toolchains = ["@bazel_tools//tools/cpp:toolchain_type"],
+)
+
+def compile_args(compilation_context):
+    """ Return defines and includes of compilation context as arguments
+
+    Returns:
+      List of arguments.
+    """
+    args = []
+    for define in compilation_context.defines.to_list():
+        args.append("-D" + define)
+    for define in compilation_context.local_defines.to_list():
+        args.append("-D" + define)
+    for include in compilation_context.framework_includes.to_list():
+        args.append("-F" + include)
+    for include in compilation_context.includes.to_list():
+        args.append("-I" + include)
+    for include in compilation_context.quote_includes.to_list():
+        args.append("-iquote " + include)
+    for include in compilation_context.system_includes.to_list():
+        args.append("-isystem " + include)
+    return args
+
+def is_c_source(src):
+    """ Return True if the file should be compiled as C code """
+    return src.extension in _c_extensions
+
+def compile_info_compiler(compile_info, src):
+    """ Return C or C++ compiler path for given source file """
+    if is_c_source(src):
+        return compile_info.toolchain.compiler
+    return compile_info.toolchain.cxx_compiler
+
+def compile_info_arguments(compile_info, defines_first = False):
+    """ Return compilation arguments for C and C++ source files of the target
+
+    Arguments are built on demand from CompileInfo, call it once per target
+    and pick arguments for each source file with source_arguments().
+
+    Args:
+      defines_first: put defines and includes before toolchain flags
+        (as clang-tidy and clang -analyze rules do).
+
+    Returns:
+      struct(c, cxx) of argument lists: toolchain and rule flags
+      followed by defines and includes.
+    """
+    args = compile_args(compile_info.compilation_context)
+    c_flags = safe_flags(compile_info.toolchain.c_flags + compile_info.rule_flags)
+    cxx_flags = safe_flags(compile_info.toolchain.cxx_flags + compile_info.rule_flags)
+    if defines_first:
+        return struct(c = args + c_flags, cxx = args + cxx_flags)
+    return struct(c = c_flags + args, cxx = cxx_flags + args)
+
+def source_arguments(arguments, src):
+    """ Return arguments from compile_info_arguments() for given source file """
+    if is_c_source(src):
+        return arguments.c
+    return arguments.cxx
+
+def valid_compile_target(target, ctx):
+    """ Return True if the target should be analyzed """
+
+    # if not a C/C++ target, we are not interested
+    if not CcInfo in target:
+        return False
+
+    # Ignore external targets
+    if target.label.workspace_root.startswith("external"):
+        return False
+
+    # Targets with specific tags will not be analyzed
+    ignore_tags = [
+        "noclangtidy",
+        "no-clang-tidy",
+    ]
+    for tag in ignore_tags:
+        if tag in ctx.rule.attr.tags:
+            return False
+    return True
+
+def _accumulate_sources(sources, deps, field):
+    transitive = [sources]
+    if type(deps) == "list":
+        for dep in deps:
+            if CompileInfo in dep:
+                transitive.append(getattr(dep[CompileInfo], field))
+    return depset(transitive = transitive)
+
+def _target_toolchain_flags(ctx):
+    # Share flags of the configuration unless the target requests
+    # other features than the configuration does
+    shared = ctx.attr._cc_toolchain_flags[CcToolchainFlagsInfo].toolchain
+    if (sorted(ctx.features) == sorted(shared.features) and
+        sorted(ctx.disabled_features) == sorted(shared.disabled_features)):
+        return shared
+    return toolchain_flags(ctx)
+
+def _compile_info_aspect_impl(target, ctx):
+    # Always return the provider, as advertised by compile_info_aspect
+    if not CcInfo in target:
+        return [
+            CompileInfo(
+                sources = depset(),
+                tidy_sources = depset(),
+                toolchain = None,
+                rule_flags = [],
+                compilation_context = None,
+            ),
+        ]
+
+    # Targets not valid for clang-tidy (and their dependencies)
+    # are still analyzed by CTU and CodeChecker rules
+    valid = valid_compile_target(target, ctx)
+    own_sources = rule_sources(ctx)
+    sources = depset(own_sources)
+    tidy_sources = depset(own_sources if valid else [])
+    for attr in _source_attr:
+        if hasattr(ctx.rule.attr, attr):
+            deps = getattr(ctx.rule.attr, attr)
+            sources = _accumulate_sources(sources, deps, "sources")
+            if valid:
+                tidy_sources = _accumulate_sources(tidy_sources, deps, "tidy_sources")
+
+    return [
+        CompileInfo(
+            sources = sources,
+            tidy_sources = tidy_sources,
+            toolchain = _target_toolchain_flags(ctx),
+            rule_flags = ctx.rule.attr.copts if hasattr(ctx.rule.attr, "copts") else [],
+            compilation_context = target[CcInfo].compilation_context,
+        ),
+    ]
+
+compile_info_aspect = aspect(
+    implementation = _compile_info_aspect_impl,
+    provides = [CompileInfo],
+    fragments = ["cpp"],
+    attrs = {
+        "_cc_toolchain": attr.label(default = Label("@bazel_tools//tools/cpp:current_cc_toolchain")),
+        "_cc_toolchain_flags": attr.label(default = Label("@bazel_codechecker//src:cc_toolchain_flags")),
+    },
+    attr_aspects = _source_attr,
+    toolchains = ["@bazel_tools//tools/cpp:toolchain_type"],
+)
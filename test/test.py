@@ -15,13 +15,19 @@
 """
 Unit and functional tests
 """
+import importlib.util
+import json
 import logging
 import os
 import re
 import shlex
+import shutil
+import sqlite3
 import subprocess
 import sys
+import tempfile
 import unittest
+from unittest import mock
 
 
 class TestBase(unittest.TestCase):
@@ -50,6 +56,21 @@ class TestBase(unittest.TestCase):
         """Before every test"""
         logging.debug("\n%s", "-" * 70)
 
+    @classmethod
+    def load_module(cls, name):
+        """Load Python file from src directory as a module"""
+        spec = importlib.util.spec_from_file_location(
+            name, os.path.join(cls.test_dir, "..", "src", name + ".py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    def create_tmp_dir(self):
+        """Create temporary directory removed after the test"""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return tmp_dir
+
     def check_command(self, cmd, exit_code=0):
         """Run shell command and check status"""
         logging.debug("Running: %s", cmd)
@@ -112,6 +133,122 @@ class TestBasic(TestBase):
             self.BAZEL_BIN_DIR, "codechecker_ctu", "codechecker.log")
         self.grep_file(logfile, "// CTU example")
 
+    def test_bazel_test_per_library_pass(self):
+        """Test: bazel test :codechecker_per_library_pass"""
+        self.check_command("bazel test :codechecker_per_library_pass", exit_code=0)
+
+    def test_bazel_test_per_library_fail(self):
+        """Test: bazel test :codechecker_per_library_fail"""
+        self.check_command("bazel test :codechecker_per_library_fail", exit_code=3)
+        logfile = os.path.join(
+            self.BAZEL_BIN_DIR, "codechecker_per_library_fail", "codechecker.log")
+        self.grep_file(logfile, r"core.NullDereference\s+\|\s+HIGH\s+\|\s+1")
+        self.grep_file(logfile, r"lib.cc\s+\|\s+3")
+
+    def test_bazel_test_index_fail(self):
+        """Test: bazel test :codechecker_index_fail"""
+        with tempfile.TemporaryDirectory() as test_dir:
+            command = self.local_files_command(":codechecker_index_fail", test_dir)
+            self.check_command(command, exit_code=3)
+            self.check_command("bazel clean")
+            self.check_command(command, exit_code=3)
+            # Defects are counted from the results index
+            logfile = os.path.join(
+                self.BAZEL_TESTLOGS_DIR, "codechecker_index_fail", "test.log")
+            self.grep_file(logfile, r"results index: .*codechecker_index\.sqlite")
+            self.grep_file(logfile, r"HIGH : [1-9]")
+            # Reports of both runs are merged by hash into local index
+            database = os.path.join(test_dir, "codechecker_index.sqlite")
+            connection = sqlite3.connect(database)
+            runs = connection.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+            reports = connection.execute(
+                "SELECT COUNT(*), MIN(first_run), MAX(last_run) FROM reports").fetchone()
+            per_run = connection.execute(
+                "SELECT COUNT(*) FROM run_reports WHERE run_id = 1").fetchone()[0]
+            connection.close()
+            self.assertEqual(runs, 2)
+            self.assertEqual(reports, (per_run, 1, 2))
+            # Hermetic index of the last run only
+            index = os.path.join(
+                self.BAZEL_BIN_DIR, "codechecker_index_fail", "codechecker_index.sqlite")
+            connection = sqlite3.connect(index)
+            self.assertEqual(
+                connection.execute("SELECT id, timestamp FROM runs").fetchall(), [(1, 0)])
+            connection.close()
+
+    def local_files_command(self, target, test_dir):
+        """Return bazel test command with local stats and index directory"""
+        return " ".join([
+            "bazel test",
+            target,
+            f"--define=CODECHECKER_TEST_DIR={test_dir}",
+            f"--sandbox_writable_path={test_dir}",
+        ])
+
+    def test_bazel_test_stats(self):
+        """Test: bazel test :codechecker_stats"""
+        with tempfile.TemporaryDirectory() as test_dir:
+            command = self.local_files_command(":codechecker_stats", test_dir)
+            self.check_command(command, exit_code=3)
+            with open(os.path.join(test_dir, "codechecker_stats.json"), "r") as fileobj:
+                durations = json.load(fileobj)["durations"]
+            self.assertEqual(
+                sorted(os.path.basename(name) for name in durations),
+                ["ctu.cc", "fail.cc", "lib.cc"])
+            # Second run analyzes the slowest files first
+            self.check_command("bazel clean")
+            self.check_command(command, exit_code=3)
+            compile_commands = os.path.join(
+                self.BAZEL_BIN_DIR, "codechecker_stats", "codechecker-files",
+                "compile_commands.json")
+            with open(compile_commands, "r") as fileobj:
+                scheduled = [durations[entry["file"]] for entry in json.load(fileobj)]
+            self.assertEqual(scheduled, sorted(scheduled, reverse=True))
+            logfile = os.path.join(
+                self.BAZEL_BIN_DIR, "codechecker_stats", "codechecker.log")
+            self.grep_file(logfile, r"Running CodeChecker analyze\.\.\.")
+
+    def test_bazel_test_stats_outlier(self):
+        """Test: bazel test :codechecker_stats_outlier"""
+        with tempfile.TemporaryDirectory() as test_dir:
+            stats_file = os.path.join(test_dir, "codechecker_stats_outlier.json")
+            with open(stats_file, "w") as fileobj:
+                json.dump({"version": 1, "durations": {
+                    "test/src/ctu.cc": 1,
+                    "test/src/fail.cc": 1,
+                    "test/src/lib.cc": 1000,
+                }}, fileobj)
+            command = self.local_files_command(":codechecker_stats_outlier", test_dir)
+            self.check_command(command, exit_code=3)
+            logfile = os.path.join(
+                self.BAZEL_BIN_DIR, "codechecker_stats_outlier", "codechecker.log")
+            self.grep_file(logfile, r"Analysis budget for outliers: 10 sec")
+            self.grep_file(logfile, r"outlier:.*test/src/lib\.cc")
+            self.grep_file(logfile, r"lib.cc\s+\|\s+3")
+            with open(stats_file, "r") as fileobj:
+                durations = json.load(fileobj)["durations"]
+            self.assertLess(durations["test/src/lib.cc"], 10)
+
+    def test_bazel_test_stats_ctu(self):
+        """Test: bazel test :codechecker_stats_ctu"""
+        with tempfile.TemporaryDirectory() as test_dir:
+            command = self.local_files_command(":codechecker_stats_ctu", test_dir)
+            self.check_command(command, exit_code=3)
+            logfile = os.path.join(
+                self.BAZEL_BIN_DIR, "codechecker_stats_ctu", "codechecker.log")
+            self.grep_file(logfile, r"CTU analysis: reordering compilation database only")
+            self.assertTrue(os.path.isfile(
+                os.path.join(test_dir, "codechecker_stats_ctu.json")))
+
+    def test_bazel_test_skip(self):
+        """Test: bazel test :codechecker_skip"""
+        self.check_command("bazel test :codechecker_skip", exit_code=0)
+        compile_commands = os.path.join(
+            self.BAZEL_BIN_DIR, "codechecker_skip", "codechecker_commands.json")
+        self.grep_file(compile_commands, r"fail\.cc")
+        with open(compile_commands, "r") as fileobj:
+            self.assertNotIn("lib.cc", fileobj.read())
+
     def test_bazel_build_fail(self):
         """Test: bazel build :test_fail"""
         self.check_command("bazel build :test_fail", exit_code=0)
@@ -193,6 +330,327 @@ class TestBasic(TestBase):
         self.grep_file(logfile, "// CTU example")
 
 
+class TestScript(TestBase):
+    """Unit tests for codechecker_script.py functions"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Load script template as a module"""
+        super().setUpClass()
+        cls.script = cls.load_module("codechecker_script")
+
+    def setUp(self):
+        """Before every test: create temporary directory"""
+        super().setUp()
+        self.tmp_dir = self.create_tmp_dir()
+        self.script.CODECHECKER_ANALYZE = ""
+        self.script.CODECHECKER_FILES = "{codechecker_files}"
+        self.script.CODECHECKER_OUTLIER_FACTOR = "{codechecker_outlier_factor}"
+
+    def write_json(self, filename, data):
+        """Write data to JSON file in temporary directory"""
+        path = os.path.join(self.tmp_dir, filename)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as fileobj:
+            json.dump(data, fileobj)
+        return path
+
+    def test_schedule(self):
+        """Test: unknown files first, then longest first"""
+        commands = [{"file": "a.cc"}, {"file": "b.cc"}, {"file": "c.cc"}]
+        durations = {"a.cc": 1.0, "c.cc": 5.0}
+        scheduled = self.script.schedule(commands, durations)
+        self.assertEqual([entry["file"] for entry in scheduled], ["b.cc", "c.cc", "a.cc"])
+
+    def test_analysis_budget(self):
+        """Test: budget is outlier factor times median duration"""
+        commands = [{"file": name} for name in ["a.cc", "b.cc", "c.cc", "d.cc"]]
+        durations = {"a.cc": 1.0, "b.cc": 2.0, "c.cc": 100.0}
+        self.assertIsNone(self.script.analysis_budget(commands, durations))
+        self.script.CODECHECKER_OUTLIER_FACTOR = "10"
+        budget = self.script.analysis_budget(commands, durations)
+        self.assertEqual(budget, 20)
+        self.assertEqual(self.script.find_outliers(commands, durations, budget), ["c.cc"])
+        self.assertEqual(self.script.find_outliers(commands, {}, None), [])
+
+    def test_analyze_jobs(self):
+        """Test: number of jobs from CodeChecker analyze arguments"""
+        self.script.CODECHECKER_ANALYZE = "--ctu -j 3"
+        self.assertEqual(self.script.analyze_jobs(), 3)
+        self.script.CODECHECKER_ANALYZE = "--jobs=2"
+        self.assertEqual(self.script.analyze_jobs(), 2)
+        self.script.CODECHECKER_ANALYZE = ""
+        self.assertGreaterEqual(self.script.analyze_jobs(), 1)
+
+    def test_analyze_timed_out(self):
+        """Test: only exceeded timeout is reported as timeout"""
+        self.assertTrue(self.script.analyze_timed_out(
+            "[WARNING] - Analyzer ran too long, exceeding time limit of 10 seconds."))
+        self.assertFalse(self.script.analyze_timed_out(
+            "[ERROR] - Failed to analyze a.cc\n- Failed to analyze 1 file(s)"))
+
+    def test_analyze_split(self):
+        """Test: one call for regular files, single job calls with timeout for outliers"""
+        self.script.CODECHECKER_FILES = self.tmp_dir
+        commands = [{"file": name} for name in ["c.cc", "d.cc", "a.cc", "b.cc"]]
+        durations = {"a.cc": 1.0, "b.cc": 2.0, "c.cc": 100.0, "d.cc": 100.0}
+        scheduled = []
+
+        def analyze_scheduled(compile_commands, durations, env):
+            scheduled.extend(entry["file"] for entry in compile_commands)
+
+        def analyze_translation_unit(task):
+            compile_commands, output, timeout, _ = task
+            with open(compile_commands, "r") as fileobj:
+                filename = json.load(fileobj)[0]["file"]
+            self.assertEqual(timeout, 20)
+            os.makedirs(output)
+            with open(os.path.join(output, filename + ".plist"), "w") as fileobj:
+                fileobj.write(filename)
+            if filename == "d.cc":
+                return 25.0, 1, "Analyzer ran too long, exceeding time limit"
+            return 5.0, 0, ""
+
+        with mock.patch.object(self.script, "analyze_scheduled", analyze_scheduled), \
+                mock.patch.object(self.script, "analyze_translation_unit",
+                                  analyze_translation_unit):
+            self.script.analyze_split(commands, durations, 20, ["c.cc", "d.cc"], {})
+        self.assertEqual(scheduled, ["a.cc", "b.cc"])
+        self.assertEqual(durations["c.cc"], 5.0)
+        self.assertEqual(durations["d.cc"], 20)
+        self.assertEqual(self.script.load_timeouts(), ["d.cc"])
+        for filename in ["c.cc", "d.cc"]:
+            self.assertTrue(os.path.isfile(
+                os.path.join(self.tmp_dir, "data", filename + ".plist")))
+        self.assertTrue(self.script.analyze_command(
+            "compile_commands.json", "data", 20, jobs=1).endswith(" --timeout=20 --jobs=1"))
+
+    def test_merge_results(self):
+        """Test: merge metadata and report different copies of other files"""
+        data = os.path.join(self.tmp_dir, "data")
+        tool = {"name": "codechecker", "result_source_files": {"a.plist": "a.cc"}}
+        self.write_json("data/metadata.json", {"tools": [tool]})
+        self.write_json("data/same.json", [1])
+        self.write_json("data/other.json", [1])
+        tool = {"name": "codechecker", "result_source_files": {"b.plist": "b.cc"}}
+        self.write_json("tu/metadata.json", {"tools": [tool]})
+        self.write_json("tu/same.json", [1])
+        self.write_json("tu/other.json", [2])
+        self.write_json("tu/b.plist", {})
+        collisions = self.script.merge_results(os.path.join(self.tmp_dir, "tu"), data)
+        self.assertEqual(collisions, ["other.json"])
+        self.assertTrue(os.path.isfile(os.path.join(data, "b.plist")))
+        with open(os.path.join(data, "metadata.json"), "r") as fileobj:
+            metadata = json.load(fileobj)
+        self.assertEqual(metadata["tools"][0]["result_source_files"],
+                         {"a.plist": "a.cc", "b.plist": "b.cc"})
+
+    def test_index_severities(self):
+        """Test: defects are counted by codechecker_index.py"""
+        tool = os.path.join(self.test_dir, "..", "src", "codechecker_index.py")
+        result = self.write_json("result.json", [
+            {"report_hash": "h1", "checker_name": "core.DivideZero", "severity": "HIGH"},
+            {"report_hash": "h2", "checker_name": "core.DivideZero", "severity": "HIGH",
+             "review_status": "intentional"},
+        ])
+        database = os.path.join(self.tmp_dir, "index.sqlite")
+        subprocess.check_call(
+            [sys.executable, tool, "load", "-i", result, "-d", database, "-r", "r"])
+        self.script.CODECHECKER_INDEX_TOOL = tool
+        self.assertEqual(self.script.index_severities(database), {"HIGH": 1})
+
+    def test_estimate_durations(self):
+        """Test: durations from result file times with 1 job"""
+        results = {}
+        for name, end in [("a", 10), ("b", 15), ("c", 40)]:
+            path = self.write_json(name + ".plist", {})
+            os.utime(path, (end, end))
+            results[path] = "/execroot/test/src/%s.cc" % name
+        self.write_json("metadata.json", {"tools": [{"result_source_files": results}]})
+        commands = [{"file": "test/src/%s.cc" % name} for name in "abc"]
+        durations = self.script.estimate_durations(commands, self.tmp_dir, 0, 1)
+        self.assertEqual(durations, {
+            "test/src/a.cc": 10,
+            "test/src/b.cc": 5,
+            "test/src/c.cc": 25,
+        })
+
+
+class TestFilter(TestBase):
+    """Unit tests for compile_commands_filter.py skip rules"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Load filter script as a module"""
+        super().setUpClass()
+        cls.filter = cls.load_module("compile_commands_filter")
+
+    def skip_rules(self, *lines):
+        """Load skip rules from given skipfile lines"""
+        with tempfile.NamedTemporaryFile("w", suffix=".skipfile") as skipfile:
+            skipfile.write("\n".join(lines) + "\n")
+            skipfile.flush()
+            return self.filter.load_skip_rules(skipfile.name)
+
+    def test_skip_star_rule(self):
+        """Test: rule starting with "*" skips file"""
+        rules = self.skip_rules("-*/src/lib.cc")
+        self.assertTrue(self.filter.is_skipped("test/src/lib.cc", rules))
+        self.assertFalse(self.filter.is_skipped("test/src/pass.cc", rules))
+
+    def test_skip_absolute_rule(self):
+        """Test: rule starting with "/" is left to CodeChecker"""
+        rules = self.skip_rules("-/test/*", "-*/src/lib.cc")
+        self.assertEqual(len(rules), 1)
+        self.assertFalse(self.filter.is_skipped("test/src/lib.cc", rules))
+
+    def test_skip_wildcard_rule(self):
+        """Test: rule with "?" wildcard and next rules are left to CodeChecker"""
+        rules = self.skip_rules("-*/src/li?.cc", "-*/src/lib.cc")
+        self.assertFalse(self.filter.is_skipped("test/src/lib.cc", rules))
+
+    def test_skip_include_rule(self):
+        """Test: file is kept unless it is skipped for sure"""
+        rules = self.skip_rules("+*/src/pass.cc", "-*")
+        self.assertFalse(self.filter.is_skipped("test/src/pass.cc", rules))
+        # CodeChecker may match "+" rule to absolute path, keep the file
+        rules = self.skip_rules("+*/execroot/*", "-*")
+        self.assertFalse(self.filter.is_skipped("test/src/lib.cc", rules))
+        rules = self.skip_rules("-*/src/lib.cc", "+*")
+        self.assertTrue(self.filter.is_skipped("test/src/lib.cc", rules))
+
+
+class TestIndex(TestBase):
+    """Unit tests for codechecker_index.py"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Load index tool as a module"""
+        super().setUpClass()
+        cls.index = cls.load_module("codechecker_index")
+        cls.tool = cls.index.__file__
+
+    def setUp(self):
+        """Before every test: create temporary directory"""
+        super().setUp()
+        self.tmp_dir = self.create_tmp_dir()
+        self.database = os.path.join(self.tmp_dir, "index.sqlite")
+
+    def report(self, report_hash, checker, severity, review_status="unreviewed"):
+        """Return report as exported by CodeChecker parse --export=json"""
+        return {
+            "report_hash": report_hash,
+            "checker_name": checker,
+            "severity": severity,
+            "file": {"path": "/execroot/test/src/fail.cc",
+                     "original_path": "/execroot/test/src/fail.cc"},
+            "line": 3,
+            "column": 5,
+            "message": checker + " message",
+            "review_status": review_status,
+        }
+
+    def load_run(self, name, reports):
+        """Load reports with CodeChecker JSON format into local database"""
+        result = os.path.join(self.tmp_dir, "result.json")
+        with open(result, "w") as fileobj:
+            json.dump({"version": 1, "reports": reports}, fileobj)
+        output = os.path.join(self.tmp_dir, "output.sqlite")
+        if os.path.exists(output):
+            os.remove(output)
+        self.check_command(" ".join([
+            f"{sys.executable} {self.tool} load -i {result} -d {output}",
+            f"-l {self.database} -r {name}"]))
+
+    def run_tool(self, arguments):
+        """Run index tool and return its output"""
+        output = subprocess.check_output(
+            [sys.executable, self.tool] + shlex.split(arguments))
+        return output.decode("utf-8")
+
+    def test_merge_by_hash(self):
+        """Test: reports of runs are merged by report hash"""
+        self.load_run("//test:a", [
+            self.report("h1", "core.DivideZero", "HIGH"),
+            self.report("h2", "deadcode.DeadStores", "LOW"),
+        ])
+        self.load_run("//test:a", [
+            self.report("h1", "core.DivideZero", "HIGH"),
+            self.report("h3", "core.NullDereference", "HIGH", "false_positive"),
+        ])
+        connection = sqlite3.connect(self.database)
+        reports = connection.execute(
+            "SELECT hash, first_run, last_run FROM reports ORDER BY hash").fetchall()
+        self.assertEqual(reports, [("h1", 1, 2), ("h2", 1, 1), ("h3", 2, 2)])
+        # Suppressed reports are not counted
+        self.assertEqual(self.index.count_severities(connection), {"HIGH": 1})
+        self.assertEqual(self.index.count_severities(connection, 1), {"HIGH": 1, "LOW": 1})
+        connection.close()
+
+    def test_update_by_hash(self):
+        """Test: known report is updated with location and severity of the last run"""
+        self.load_run("//test:a", [self.report("h1", "core.DivideZero", "HIGH")])
+        report = self.report("h1", "core.DivideZero", "MEDIUM")
+        report["line"] = 7
+        self.load_run("//test:a", [report])
+        connection = sqlite3.connect(self.database)
+        reports = connection.execute(
+            "SELECT severity, line, first_run, last_run FROM reports").fetchall()
+        self.assertEqual(reports, [("MEDIUM", 7, 1, 2)])
+        connection.close()
+
+    def test_fixed_timestamp(self):
+        """Test: loaded database has zero timestamp, local database real time"""
+        local_database = os.path.join(self.tmp_dir, "local.sqlite")
+        result = os.path.join(self.tmp_dir, "result.json")
+        with open(result, "w") as fileobj:
+            json.dump([self.report("h1", "core.DivideZero", "HIGH")], fileobj)
+        self.run_tool(f"load -i {result} -d {self.database} -l {local_database} -r r")
+        connection = sqlite3.connect(self.database)
+        self.assertEqual(connection.execute("SELECT timestamp FROM runs").fetchall(), [(0,)])
+        connection.close()
+        connection = sqlite3.connect(local_database)
+        timestamp = connection.execute("SELECT timestamp FROM runs").fetchone()[0]
+        connection.close()
+        self.assertGreater(timestamp, 0)
+
+    def test_query(self):
+        """Test: query reports of the last run by filters"""
+        self.load_run("//test:a", [
+            self.report("h1", "core.DivideZero", "HIGH"),
+            self.report("h2", "core.NullDereference", "HIGH"),
+            self.report("h3", "deadcode.DeadStores", "LOW"),
+        ])
+        output = self.run_tool(f"query -d {self.database} -g severity")
+        self.assertRegex(output, r"HIGH\s+2")
+        self.assertRegex(output, r"LOW\s+1")
+        output = self.run_tool(f"query -d {self.database} -c core.* -s low")
+        self.assertEqual(output, "")
+        output = self.run_tool(f"query -d {self.database} -c core.N* -f */src/*")
+        self.assertEqual(
+            output, "/execroot/test/src/fail.cc:3:5: [HIGH] "
+                    "core.NullDereference: core.NullDereference message\n")
+
+    def test_compare(self):
+        """Test: compare checker counts with the previous run"""
+        self.load_run("//test:a", [
+            self.report("h1", "core.DivideZero", "HIGH"),
+            self.report("h2", "deadcode.DeadStores", "LOW"),
+        ])
+        self.load_run("//test:a", [
+            self.report("h1", "core.DivideZero", "HIGH"),
+            self.report("h3", "core.DivideZero", "HIGH"),
+        ])
+        output = self.run_tool(f"compare -d {self.database} -r //test:a")
+        self.assertRegex(output, r"deadcode.DeadStores\s+1 ->\s+0 \(-1\)")
+        self.assertRegex(output, r"core.DivideZero\s+1 ->\s+2 \(\+1\)")
+        # No run is older than a day
+        self.check_command(
+            f"{sys.executable} {self.tool} compare -d {self.database} -r //test:a --days 1",
+            exit_code=1)
+
+
 def setup_logging():
     """Setup logging level for test execution"""
     # Enable debug logs for tests if "super verbose" flag is provided